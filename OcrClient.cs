@@ -1,9 +1,17 @@
 using System;
+using System.Net;
 using System.Net.Http;
+using System.Net.Http.Headers;
 using System.IO;
+using System.Threading;
 using System.Threading.Tasks;
 using Newtonsoft.Json;
 using System.Collections.Generic;
+using System.Linq;
+using SixLabors.ImageSharp;
+using SixLabors.ImageSharp.Formats.Jpeg;
+using SixLabors.ImageSharp.Metadata.Profiles.Exif;
+using SixLabors.ImageSharp.Processing;
 
 namespace SuryaOcrClient
 {
@@ -11,54 +19,135 @@ namespace SuryaOcrClient
     {
         [JsonProperty("text")]
         public string Text { get; set; }
-        
+
         [JsonProperty("details")]
         public List<TextDetail> Details { get; set; }
-        
+
         public class TextDetail
         {
             [JsonProperty("text")]
             public string Text { get; set; }
-            
+
             [JsonProperty("bbox")]
             public float[] BoundingBox { get; set; }
         }
     }
-    
+
+    /// <summary>
+    /// Result of one file in a batch submission
+    /// </summary>
+    public class OcrBatchItem
+    {
+        public string ImagePath { get; set; }
+        public OcrResult Result { get; set; }
+        public Exception Error { get; set; }
+        public bool Success => Error == null;
+    }
+
+    public class SuryaOcrClientOptions
+    {
+        /// <summary>Maximum number of requests this client has in flight at once</summary>
+        public int MaxConcurrentRequests { get; set; } = 4;
+
+        /// <summary>Retries on 429/503 and transient network errors</summary>
+        public int MaxRetries { get; set; } = 3;
+
+        /// <summary>First backoff delay; doubled on every retry unless the server sends Retry-After</summary>
+        public TimeSpan InitialRetryDelay { get; set; } = TimeSpan.FromMilliseconds(500);
+
+        public TimeSpan MaxRetryDelay { get; set; } = TimeSpan.FromSeconds(30);
+
+        /// <summary>Timeout of a single attempt</summary>
+        public TimeSpan RequestTimeout { get; set; } = TimeSpan.FromMinutes(5);
+
+        /// <summary>
+        /// When set, images whose longer side exceeds this are downscaled before upload.
+        /// Returned bounding boxes are mapped back to the coordinates of the original image.
+        /// </summary>
+        public int? MaxImageDimension { get; set; }
+
+        /// <summary>Re-encode every image as JPEG before upload, even if it is not downscaled</summary>
+        public bool ReencodeAsJpeg { get; set; }
+
+        public int JpegQuality { get; set; } = 85;
+
+        /// <summary>OCR endpoint path: "/ocr" for api.py, "/api/ocr" for unified_app.py</summary>
+        public string OcrPath { get; set; } = "/ocr";
+    }
+
     public class SuryaOcrClient
     {
+        private const int StreamBufferSize = 81920;
+
+        // One pooled handler for the whole process; connections are recycled so DNS changes are picked up
+        private static readonly SocketsHttpHandler SharedHandler = new SocketsHttpHandler
+        {
+            PooledConnectionLifetime = TimeSpan.FromMinutes(5),
+            PooledConnectionIdleTimeout = TimeSpan.FromMinutes(1),
+            MaxConnectionsPerServer = 64,
+            AutomaticDecompression = DecompressionMethods.All
+        };
+
+        /// <summary>
+        /// HttpClient over the shared pooled handler; use it for any other HTTP calls (e.g. downloads)
+        /// instead of creating new HttpClient instances
+        /// </summary>
+        public static HttpClient SharedHttpClient { get; } = new HttpClient(SharedHandler, disposeHandler: false)
+        {
+            // Per-attempt timeouts are applied with cancellation tokens
+            Timeout = Timeout.InfiniteTimeSpan
+        };
+
+        private static readonly JsonSerializer Serializer = JsonSerializer.CreateDefault();
+
         private readonly HttpClient _httpClient;
         private readonly string _apiBaseUrl;
-        
+        private readonly SuryaOcrClientOptions _options;
+        private readonly SemaphoreSlim _throttle;
+
         public SuryaOcrClient(string apiBaseUrl)
+            : this(SharedHttpClient, apiBaseUrl, null)
         {
-            _httpClient = new HttpClient();
+        }
+
+        public SuryaOcrClient(string apiBaseUrl, SuryaOcrClientOptions options)
+            : this(SharedHttpClient, apiBaseUrl, options)
+        {
+        }
+
+        /// <summary>
+        /// Creates a client over an existing HttpClient, e.g. one from IHttpClientFactory
+        /// </summary>
+        public SuryaOcrClient(HttpClient httpClient, string apiBaseUrl, SuryaOcrClientOptions options = null)
+        {
+            _httpClient = httpClient ?? throw new ArgumentNullException(nameof(httpClient));
             _apiBaseUrl = apiBaseUrl.TrimEnd('/');
+            _options = options ?? new SuryaOcrClientOptions();
+            _throttle = new SemaphoreSlim(Math.Max(1, _options.MaxConcurrentRequests));
         }
-        
-        public async Task<OcrResult> PerformOcrAsync(string imagePath, string languages = "en")
-        {
-            using var multipartContent = new MultipartFormDataContent();
-            
-            // Add the image file
-            var fileBytes = await File.ReadAllBytesAsync(imagePath);
-            var imageContent = new ByteArrayContent(fileBytes);
-            multipartContent.Add(imageContent, "image", Path.GetFileName(imagePath));
-            
-            // Add language parameter
-            multipartContent.Add(new StringContent(languages), "langs");
-            
-            // Send the request
-            var response = await _httpClient.PostAsync($"{_apiBaseUrl}/ocr", multipartContent);
-            
-            // Handle the response
-            response.EnsureSuccessStatusCode();
-            var responseContent = await response.Content.ReadAsStringAsync();
-            var result = JsonConvert.DeserializeObject<OcrResult>(responseContent);
-            
-            return result;
+
+        private bool PreprocessingEnabled => _options.MaxImageDimension.HasValue || _options.ReencodeAsJpeg;
+
+        /// <summary>
+        /// Performs OCR on an image file, streaming it from disk
+        /// </summary>
+        public async Task<OcrResult> PerformOcrAsync(string imagePath, string languages = "en", CancellationToken cancellationToken = default)
+        {
+            var filename = Path.GetFileName(imagePath);
+
+            if (PreprocessingEnabled)
+            {
+                await using var file = OpenRead(imagePath);
+                var prepared = await PreprocessAsync(file, filename, cancellationToken);
+                if (prepared != null)
+                {
+                    return await SendPreparedAsync(prepared.Value, languages, cancellationToken);
+                }
+            }
+
+            return await SendAsync(() => new StreamContent(OpenRead(imagePath), StreamBufferSize), filename, languages, cancellationToken);
         }
-        
+
         /// <summary>
         /// Performs OCR on an image provided as a byte array
         /// </summary>
@@ -66,40 +155,335 @@ namespace SuryaOcrClient
         /// <param name="filename">Name of the file (used for content type detection)</param>
         /// <param name="languages">Comma-separated list of language codes</param>
         /// <returns>OCR result with extracted text</returns>
-        public async Task<OcrResult> PerformOcrAsync(byte[] imageBytes, string filename, string languages = "en")
-        {
-            using var multipartContent = new MultipartFormDataContent();
-            
-            // Add the image from byte array
-            var imageContent = new ByteArrayContent(imageBytes);
-            multipartContent.Add(imageContent, "image", filename);
-            
-            // Add language parameter
-            multipartContent.Add(new StringContent(languages), "langs");
-            
-            // Send the request
-            var response = await _httpClient.PostAsync($"{_apiBaseUrl}/ocr", multipartContent);
-            
-            // Handle the response
-            response.EnsureSuccessStatusCode();
-            var responseContent = await response.Content.ReadAsStringAsync();
-            var result = JsonConvert.DeserializeObject<OcrResult>(responseContent);
-            
-            return result;
+        public async Task<OcrResult> PerformOcrAsync(byte[] imageBytes, string filename, string languages = "en", CancellationToken cancellationToken = default)
+        {
+            if (PreprocessingEnabled)
+            {
+                using var source = new MemoryStream(imageBytes, writable: false);
+                var prepared = await PreprocessAsync(source, filename, cancellationToken);
+                if (prepared != null)
+                {
+                    return await SendPreparedAsync(prepared.Value, languages, cancellationToken);
+                }
+            }
+
+            return await SendAsync(() => new ByteArrayContent(imageBytes), filename, languages, cancellationToken);
         }
-        
+
         /// <summary>
-        /// Performs OCR on an image provided as a MemoryStream
+        /// Performs OCR on an image provided as a stream without copying it into memory.
+        /// Non-seekable streams are spooled to a temporary file so that retries can resend them.
+        /// The caller keeps ownership of the stream.
         /// </summary>
-        /// <param name="imageStream">The image data as a MemoryStream</param>
+        /// <param name="imageStream">The image data</param>
         /// <param name="filename">Name of the file (used for content type detection)</param>
         /// <param name="languages">Comma-separated list of language codes</param>
         /// <returns>OCR result with extracted text</returns>
-        public async Task<OcrResult> PerformOcrAsync(MemoryStream imageStream, string filename, string languages = "en")
+        public async Task<OcrResult> PerformOcrAsync(Stream imageStream, string filename, string languages = "en", CancellationToken cancellationToken = default)
+        {
+            if (!imageStream.CanSeek)
+            {
+                await using var spooled = new FileStream(Path.GetTempFileName(), FileMode.Create, FileAccess.ReadWrite,
+                    FileShare.None, StreamBufferSize, FileOptions.Asynchronous | FileOptions.DeleteOnClose);
+                await imageStream.CopyToAsync(spooled, StreamBufferSize, cancellationToken);
+                spooled.Position = 0;
+                return await PerformOcrAsync(spooled, filename, languages, cancellationToken);
+            }
+
+            var start = imageStream.Position;
+            if (PreprocessingEnabled)
+            {
+                var prepared = await PreprocessAsync(imageStream, filename, cancellationToken);
+                if (prepared != null)
+                {
+                    return await SendPreparedAsync(prepared.Value, languages, cancellationToken);
+                }
+            }
+
+            return await SendAsync(() =>
+            {
+                imageStream.Position = start;
+                return new LeaveOpenStreamContent(imageStream);
+            }, filename, languages, cancellationToken);
+        }
+
+        /// <summary>
+        /// Performs OCR on many files with at most MaxConcurrentRequests uploads in flight.
+        /// Results are returned in input order; a failed file does not stop the batch.
+        /// </summary>
+        public async Task<IReadOnlyList<OcrBatchItem>> PerformOcrBatchAsync(IEnumerable<string> imagePaths, string languages = "en",
+            IProgress<OcrBatchItem> progress = null, CancellationToken cancellationToken = default)
         {
-            // Convert MemoryStream to byte array
-            byte[] imageBytes = imageStream.ToArray();
-            return await PerformOcrAsync(imageBytes, filename, languages);
+            var paths = imagePaths.ToList();
+            var results = new OcrBatchItem[paths.Count];
+            var parallelOptions = new ParallelOptions
+            {
+                MaxDegreeOfParallelism = Math.Max(1, _options.MaxConcurrentRequests),
+                CancellationToken = cancellationToken
+            };
+
+            await Parallel.ForEachAsync(Enumerable.Range(0, paths.Count), parallelOptions, async (index, token) =>
+            {
+                var item = new OcrBatchItem { ImagePath = paths[index] };
+                try
+                {
+                    item.Result = await PerformOcrAsync(paths[index], languages, token);
+                }
+                catch (Exception ex) when (!token.IsCancellationRequested)
+                {
+                    item.Error = ex;
+                }
+                results[index] = item;
+                progress?.Report(item);
+            });
+
+            return results;
+        }
+
+        private async Task<OcrResult> SendPreparedAsync(PreparedImage prepared, string languages, CancellationToken cancellationToken)
+        {
+            var result = await SendAsync(() => CreateJpegContent(prepared.Bytes), prepared.Filename, languages, cancellationToken);
+            // The server saw the re-encoded image; report coordinates of the image the caller passed in
+            if (result?.Details != null)
+            {
+                foreach (var detail in result.Details)
+                {
+                    if (detail.BoundingBox != null && detail.BoundingBox.Length == 4)
+                    {
+                        detail.BoundingBox = prepared.Transform.MapBack(detail.BoundingBox);
+                    }
+                }
+            }
+            return result;
+        }
+
+        private async Task<OcrResult> SendAsync(Func<HttpContent> createImageContent, string filename, string languages, CancellationToken cancellationToken)
+        {
+            var url = $"{_apiBaseUrl}{_options.OcrPath}";
+
+            for (var attempt = 0; ; attempt++)
+            {
+                TimeSpan? retryDelay = null;
+
+                // Hold a slot only while a request is on the wire, not while backing off
+                await _throttle.WaitAsync(cancellationToken);
+                try
+                {
+                    using var multipartContent = new MultipartFormDataContent();
+                    multipartContent.Add(createImageContent(), "image", filename);
+                    multipartContent.Add(new StringContent(languages), "langs");
+
+                    using var request = new HttpRequestMessage(HttpMethod.Post, url) { Content = multipartContent };
+                    using var attemptCts = CancellationTokenSource.CreateLinkedTokenSource(cancellationToken);
+                    attemptCts.CancelAfter(_options.RequestTimeout);
+
+                    HttpResponseMessage response = null;
+                    try
+                    {
+                        response = await _httpClient.SendAsync(request, HttpCompletionOption.ResponseHeadersRead, attemptCts.Token);
+                    }
+                    catch (HttpRequestException) when (attempt < _options.MaxRetries)
+                    {
+                        retryDelay = GetRetryDelay(null, attempt);
+                    }
+
+                    if (response != null)
+                    {
+                        using (response)
+                        {
+                            if (IsRetryable(response.StatusCode) && attempt < _options.MaxRetries)
+                            {
+                                retryDelay = GetRetryDelay(response, attempt);
+                            }
+                            else
+                            {
+                                response.EnsureSuccessStatusCode();
+
+                                // Deserialize straight from the response stream instead of buffering it as a string
+                                await using var responseStream = await response.Content.ReadAsStreamAsync(attemptCts.Token);
+                                using var reader = new StreamReader(responseStream);
+                                using var jsonReader = new JsonTextReader(reader);
+                                return Serializer.Deserialize<OcrResult>(jsonReader);
+                            }
+                        }
+                    }
+                }
+                finally
+                {
+                    _throttle.Release();
+                }
+
+                await Task.Delay(retryDelay.Value, cancellationToken);
+            }
+        }
+
+        private static bool IsRetryable(HttpStatusCode statusCode)
+        {
+            return statusCode == HttpStatusCode.TooManyRequests || statusCode == HttpStatusCode.ServiceUnavailable;
+        }
+
+        private TimeSpan GetRetryDelay(HttpResponseMessage response, int attempt)
+        {
+            var retryAfter = response?.Headers.RetryAfter;
+            if (retryAfter?.Delta != null)
+            {
+                return Min(retryAfter.Delta.Value, _options.MaxRetryDelay);
+            }
+            if (retryAfter?.Date != null)
+            {
+                var untilDate = retryAfter.Date.Value - DateTimeOffset.UtcNow;
+                return Min(untilDate > TimeSpan.Zero ? untilDate : TimeSpan.Zero, _options.MaxRetryDelay);
+            }
+
+            // Exponential backoff with jitter so parallel uploads do not retry in lockstep
+            var backoff = _options.InitialRetryDelay.TotalMilliseconds * Math.Pow(2, attempt);
+            var jitter = Random.Shared.NextDouble() * _options.InitialRetryDelay.TotalMilliseconds;
+            return Min(TimeSpan.FromMilliseconds(backoff + jitter), _options.MaxRetryDelay);
+        }
+
+        private static TimeSpan Min(TimeSpan a, TimeSpan b) => a < b ? a : b;
+
+        private static FileStream OpenRead(string path)
+        {
+            return new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.Read, StreamBufferSize,
+                FileOptions.Asynchronous | FileOptions.SequentialScan);
+        }
+
+        private static HttpContent CreateJpegContent(byte[] bytes)
+        {
+            var content = new ByteArrayContent(bytes);
+            content.Headers.ContentType = new MediaTypeHeaderValue("image/jpeg");
+            return content;
+        }
+
+        /// <summary>
+        /// Downscales and/or re-encodes an image as JPEG. Returns null when the image can be sent as is.
+        /// </summary>
+        private async Task<PreparedImage?> PreprocessAsync(Stream source, string filename, CancellationToken cancellationToken)
+        {
+            var start = source.Position;
+
+            // Reading the header is enough to decide whether the image needs work
+            var info = await Image.IdentifyAsync(source, cancellationToken);
+            var maxDimension = _options.MaxImageDimension;
+            var needsResize = maxDimension.HasValue && Math.Max(info.Width, info.Height) > maxDimension.Value;
+            if (!needsResize && !_options.ReencodeAsJpeg)
+            {
+                source.Position = start;
+                return null;
+            }
+
+            source.Position = start;
+            using var image = await Image.LoadAsync(source, cancellationToken);
+            var transform = new UploadTransform(image.Width, image.Height, ReadOrientation(image));
+
+            // Apply EXIF orientation before the tag is lost in re-encoding
+            image.Mutate(x => x.AutoOrient());
+            var orientedWidth = image.Width;
+            if (needsResize)
+            {
+                image.Mutate(x => x.Resize(new ResizeOptions
+                {
+                    Mode = ResizeMode.Max,
+                    Size = new Size(maxDimension.Value, maxDimension.Value)
+                }));
+            }
+            transform.Scale = (double)image.Width / orientedWidth;
+
+            using var output = new MemoryStream();
+            await image.SaveAsJpegAsync(output, new JpegEncoder { Quality = _options.JpegQuality }, cancellationToken);
+            source.Position = start;
+            return new PreparedImage(output.ToArray(), Path.ChangeExtension(filename, ".jpg"), transform);
+        }
+
+        private static ushort ReadOrientation(Image image)
+        {
+            var profile = image.Metadata.ExifProfile;
+            if (profile != null && profile.TryGetValue(ExifTag.Orientation, out var orientation))
+            {
+                return orientation.Value;
+            }
+            return ExifOrientationMode.TopLeft;
+        }
+
+        private readonly record struct PreparedImage(byte[] Bytes, string Filename, UploadTransform Transform);
+
+        /// <summary>
+        /// How an image was changed before upload: EXIF auto-orientation, then a uniform downscale
+        /// </summary>
+        private sealed class UploadTransform
+        {
+            public UploadTransform(int sourceWidth, int sourceHeight, ushort orientation)
+            {
+                SourceWidth = sourceWidth;
+                SourceHeight = sourceHeight;
+                Orientation = orientation;
+            }
+
+            /// <summary>Pixel size of the image as the caller passed it, before orientation</summary>
+            public int SourceWidth { get; }
+            public int SourceHeight { get; }
+            public ushort Orientation { get; }
+
+            /// <summary>Uploaded size divided by the oriented size</summary>
+            public double Scale { get; set; } = 1.0;
+
+            /// <summary>Maps an (x1, y1, x2, y2) box on the uploaded image back onto the caller's image</summary>
+            public float[] MapBack(float[] bbox)
+            {
+                var corners = new[]
+                {
+                    MapPoint(bbox[0], bbox[1]), MapPoint(bbox[2], bbox[1]),
+                    MapPoint(bbox[2], bbox[3]), MapPoint(bbox[0], bbox[3])
+                };
+                return new[]
+                {
+                    (float)corners.Min(p => p.X), (float)corners.Min(p => p.Y),
+                    (float)corners.Max(p => p.X), (float)corners.Max(p => p.Y)
+                };
+            }
+
+            private (double X, double Y) MapPoint(double x, double y)
+            {
+                x /= Scale;
+                y /= Scale;
+                double width = SourceWidth, height = SourceHeight;
+                return Orientation switch
+                {
+                    ExifOrientationMode.TopRight => (width - x, y),
+                    ExifOrientationMode.BottomRight => (width - x, height - y),
+                    ExifOrientationMode.BottomLeft => (x, height - y),
+                    ExifOrientationMode.LeftTop => (y, x),
+                    ExifOrientationMode.RightTop => (y, height - x),
+                    ExifOrientationMode.RightBottom => (width - y, height - x),
+                    ExifOrientationMode.LeftBottom => (width - y, x),
+                    _ => (x, y)
+                };
+            }
+        }
+
+        /// <summary>
+        /// Streams from a caller-owned stream without disposing it
+        /// </summary>
+        private sealed class LeaveOpenStreamContent : HttpContent
+        {
+            private readonly Stream _stream;
+
+            public LeaveOpenStreamContent(Stream stream)
+            {
+                _stream = stream;
+            }
+
+            protected override Task SerializeToStreamAsync(Stream stream, TransportContext context)
+            {
+                return _stream.CopyToAsync(stream, StreamBufferSize);
+            }
+
+            protected override bool TryComputeLength(out long length)
+            {
+                length = _stream.Length - _stream.Position;
+                return true;
+            }
         }
     }
-} 
\ No newline at end of file
+}
@@ -1,5 +1,6 @@
 using System;
 using System.IO;
+using System.Linq;
 using System.Net.Http;
 using System.Threading.Tasks;
 using SuryaOcrClient;
@@ -28,31 +29,48 @@ namespace SuryaOcrConsoleExample
                     Console.WriteLine("\nOCR Sonucu (Dosya):");
                     Console.WriteLine(result.Text);
                 }
+                // Örnek 1b: Klasördeki tüm resimler, sınırlı paralellikle
+                else if (args.Length > 0 && Directory.Exists(args[0]))
+                {
+                    var files = Directory.EnumerateFiles(args[0])
+                        .Where(f => new[] { ".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp" }.Contains(Path.GetExtension(f).ToLowerInvariant()))
+                        .ToList();
+                    Console.WriteLine($"Klasördeki {files.Count} resim için OCR işlemi yapılıyor: {args[0]}");
+                    
+                    var batchClient = new SuryaOcrClient.SuryaOcrClient(apiUrl, new SuryaOcrClientOptions
+                    {
+                        MaxConcurrentRequests = 4,
+                        MaxImageDimension = 2500
+                    });
+                    var progress = new Progress<OcrBatchItem>(item =>
+                        Console.WriteLine(item.Success ? $"  Tamamlandı: {item.ImagePath}" : $"  Hata: {item.ImagePath} - {item.Error.Message}"));
+                    var results = await batchClient.PerformOcrBatchAsync(files, "en", progress);
+                    Console.WriteLine($"\n{results.Count(r => r.Success)}/{results.Count} resim başarıyla işlendi");
+                }
                 
                 // Örnek 2: URL'den resmi indirip byte[] olarak OCR işlemi
                 string imageUrl = "https://raw.githubusercontent.com/tesseract-ocr/tessdata/main/eng.training_text.png";
                 Console.WriteLine($"\nURL'den resim indirilerek OCR işlemi yapılıyor: {imageUrl}");
                 
-                using (var httpClient = new HttpClient())
+                // Paylaşılan bağlantı havuzunu kullan; her indirme için yeni HttpClient oluşturma
+                var httpClient = SuryaOcrClient.SuryaOcrClient.SharedHttpClient;
+                // Resmi indir
+                var imageBytes = await httpClient.GetByteArrayAsync(imageUrl);
+                Console.WriteLine($"İndirilen resim boyutu: {imageBytes.Length} byte");
+                
+                // OCR işlemi yap
+                var bytesResult = await ocrClient.PerformOcrAsync(imageBytes, "sample.png", "en");
+                Console.WriteLine("\nOCR Sonucu (byte[]):");
+                Console.WriteLine(bytesResult.Text);
+                
+                // Örnek 3: byte[] verisini MemoryStream'e dönüştürerek OCR işlemi
+                Console.WriteLine("\nAynı veri MemoryStream kullanılarak OCR işlemi yapılıyor");
+                
+                using (var ms = new MemoryStream(imageBytes))
                 {
-                    // Resmi indir
-                    var imageBytes = await httpClient.GetByteArrayAsync(imageUrl);
-                    Console.WriteLine($"İndirilen resim boyutu: {imageBytes.Length} byte");
-                    
-                    // OCR işlemi yap
-                    var result = await ocrClient.PerformOcrAsync(imageBytes, "sample.png", "en");
-                    Console.WriteLine("\nOCR Sonucu (byte[]):");
-                    Console.WriteLine(result.Text);
-                    
-                    // Örnek 3: byte[] verisini MemoryStream'e dönüştürerek OCR işlemi
-                    Console.WriteLine("\nAynı veri MemoryStream kullanılarak OCR işlemi yapılıyor");
-                    
-                    using (var ms = new MemoryStream(imageBytes))
-                    {
-                        var msResult = await ocrClient.PerformOcrAsync(ms, "sample.png", "en");
-                        Console.WriteLine("\nOCR Sonucu (MemoryStream):");
-                        Console.WriteLine(msResult.Text);
-                    }
+                    var msResult = await ocrClient.PerformOcrAsync(ms, "sample.png", "en");
+                    Console.WriteLine("\nOCR Sonucu (MemoryStream):");
+                    Console.WriteLine(msResult.Text);
                 }
                 
                 // Örnek 4: Bellek üzerinde oluşturulan bir resmi OCR işlemine sokma (gerçek uygulamada farklı olabilir)
@@ -12,8 +12,13 @@ using Newtonsoft.Json;
 var builder = WebApplication.CreateBuilder(args);
 
 // Add services
+// The OCR client and image downloads share one pooled HTTP handler instead of a new HttpClient per call
 builder.Services.AddSingleton<SuryaOcrClient.SuryaOcrClient>(provider => 
-    new SuryaOcrClient.SuryaOcrClient("http://localhost:5000"));
+    new SuryaOcrClient.SuryaOcrClient("http://localhost:5000", new SuryaOcrClientOptions
+    {
+        MaxConcurrentRequests = 8,
+        MaxImageDimension = 2500
+    }));
 
 // Add for file uploads
 builder.Services.AddControllersWithViews();
@@ -217,28 +222,11 @@ app.MapPost("/ocr", async (HttpContext context, SuryaOcrClient.SuryaOcrClient oc
             return Results.BadRequest("No file uploaded");
         }
         
-        // Save the uploaded file temporarily
-        var tempFilePath = Path.GetTempFileName();
-        try
-        {
-            using (var stream = new FileStream(tempFilePath, FileMode.Create))
-            {
-                await file.CopyToAsync(stream);
-            }
-            
-            // Use the OCR client to process the image
-            var result = await ocrClient.PerformOcrAsync(tempFilePath, languages);
-            
-            return Results.Json(result);
-        }
-        finally
-        {
-            // Clean up the temporary file
-            if (File.Exists(tempFilePath))
-            {
-                File.Delete(tempFilePath);
-            }
-        }
+        // Stream the upload straight to the OCR service instead of copying it to a temporary file
+        await using var stream = file.OpenReadStream();
+        var result = await ocrClient.PerformOcrAsync(stream, file.FileName, languages, context.RequestAborted);
+        
+        return Results.Json(result);
     }
     catch (Exception ex)
     {
@@ -246,7 +234,7 @@ app.MapPost("/ocr", async (HttpContext context, SuryaOcrClient.SuryaOcrClient oc
     }
 });
 
-// Handle URL-based OCR (uses byte[] method)
+// Handle URL-based OCR (uses Stream method)
 app.MapPost("/ocr-url", async (HttpContext context, SuryaOcrClient.SuryaOcrClient ocrClient) =>
 {
     try
@@ -261,16 +249,18 @@ app.MapPost("/ocr-url", async (HttpContext context, SuryaOcrClient.SuryaOcrClien
             return Results.BadRequest("No image URL provided");
         }
         
-        // Download the image using HttpClient
-        using var httpClient = new HttpClient();
-        byte[] imageBytes = await httpClient.GetByteArrayAsync(requestData.ImageUrl);
+        // Download the image over the shared pooled HttpClient and stream it on without buffering
+        using var download = await SuryaOcrClient.SuryaOcrClient.SharedHttpClient.GetAsync(
+            requestData.ImageUrl, HttpCompletionOption.ResponseHeadersRead, context.RequestAborted);
+        download.EnsureSuccessStatusCode();
+        await using var imageStream = await download.Content.ReadAsStreamAsync(context.RequestAborted);
         
         // Extract filename from URL for MIME type detection
         var uri = new Uri(requestData.ImageUrl);
         var filename = Path.GetFileName(uri.LocalPath);
         
-        // Use the OCR client's byte[] method to process the image
-        var result = await ocrClient.PerformOcrAsync(imageBytes, filename, requestData.Languages ?? "en");
+        // Use the OCR client's stream method to process the image
+        var result = await ocrClient.PerformOcrAsync(imageStream, filename, requestData.Languages ?? "en", context.RequestAborted);
         
         return Results.Json(result);
     }
@@ -0,0 +1,294 @@
+"""
+Per-tenant admission control for the OCR service.
+
+Callers are identified by API key or client id. Keys configured in
+TENANT_LIMITS are tenants of their own; every other caller shares the
+anonymous tenant, which has no quota unless TENANT_LIMITS configures it
+too. Each limited tenant has a token bucket (rate and burst) and a
+concurrency cap; requests over quota are rejected immediately with a
+Retry-After hint. Requests that pass are queued per tenant and granted inference slots round-robin across tenants, so one
+integration posting thousands of receipts cannot starve everybody else.
+Everything is tracked in-process.
+"""
+import os
+import json
+import math
+import asyncio
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# Callers whose key is not configured in TENANT_LIMITS all share this tenant
+ANONYMOUS = 'anonymous'
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is over its tenant's quota; carries the HTTP status and Retry-After"""
+    def __init__(self, message, status=429, retry_after=1):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class _Waiter:
+    def __init__(self, on_grant=None):
+        self.event = threading.Event()
+        self.granted = False
+        self.on_grant = on_grant
+
+    def grant(self):
+        self.granted = True
+        self.event.set()
+        if self.on_grant is not None:
+            self.on_grant()
+
+
+def key_id(key):
+    """Stable identifier of a tenant key that never exposes the raw API key"""
+    return 'tenant-' + hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+class _Tenant:
+    """Quota and queue of one tenant; a tenant created with limits=None has no quota"""
+    def __init__(self, name, limits=None):
+        self.name = name
+        self.limited = limits is not None
+        limits = limits or {'rate': 0.0, 'burst': 0, 'concurrency': 0, 'max_queued': 0}
+        self.rate = float(limits['rate'])
+        self.burst = int(limits['burst'])
+        self.concurrency = int(limits['concurrency'])
+        self.max_queued = int(limits['max_queued'])
+        self.tokens = float(self.burst)
+        self.refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected_rate = 0
+        self.rejected_concurrency = 0
+        self.timed_out = 0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+
+class AdmissionController:
+    """Token buckets, concurrency caps and a fair queue in front of the inference slots"""
+
+    def __init__(self, slots=1, rate=1.0, burst=10, concurrency=2, max_queued=20,
+                 queue_timeout=60.0, tenant_limits=None, enabled=True):
+        self.enabled = enabled
+        self.slots = slots
+        self.free_slots = slots
+        self.default_limits = {'rate': rate, 'burst': burst, 'concurrency': concurrency, 'max_queued': max_queued}
+        self.queue_timeout = queue_timeout
+        self.tenant_limits = tenant_limits or {}
+        self._lock = threading.Lock()
+        # Round-robin order of tenants; a tenant moves to the back after it is granted a slot
+        self._tenants = OrderedDict()
+
+    @classmethod
+    def from_env(cls, default_slots=1):
+        """Build from ADMISSION_* / TENANT_* environment variables; TENANT_LIMITS holds per-tenant JSON overrides"""
+        tenant_limits = {}
+        raw_limits = os.environ.get('TENANT_LIMITS', '')
+        if raw_limits:
+            try:
+                tenant_limits = json.loads(raw_limits)
+            except ValueError as e:
+                logger.error(f"Ignoring invalid TENANT_LIMITS: {e}")
+        return cls(
+            slots=int(os.environ.get('ADMISSION_SLOTS', str(default_slots))),
+            rate=float(os.environ.get('TENANT_RATE', '1')),
+            burst=int(os.environ.get('TENANT_BURST', '10')),
+            concurrency=int(os.environ.get('TENANT_MAX_CONCURRENCY', '2')),
+            max_queued=int(os.environ.get('TENANT_MAX_QUEUED', '20')),
+            queue_timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '60')),
+            tenant_limits=tenant_limits,
+            enabled=os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+        )
+
+    @staticmethod
+    def identify(headers, args):
+        """Caller identity from the X-API-Key / X-Client-Id headers or a client_id query parameter"""
+        return (headers.get('X-API-Key') or headers.get('X-Client-Id') or args.get('client_id') or ANONYMOUS).strip()
+
+    def resolve(self, identity):
+        """
+        Tenant key of a caller: keys configured in TENANT_LIMITS are tenants of
+        their own, any other value is the shared anonymous tenant. Unvalidated
+        identities therefore cannot mint fresh token buckets or grow the tenant map.
+        """
+        return identity if identity in self.tenant_limits else ANONYMOUS
+
+    def owner_id(self, headers):
+        """
+        Stable, non-secret identifier of the tenant that owns stored documents,
+        or None. Only an X-API-Key configured in TENANT_LIMITS counts: the other
+        identity sources are not secret, so anyone could claim them.
+        """
+        key = (headers.get('X-API-Key') or '').strip()
+        if key == ANONYMOUS or key not in self.tenant_limits:
+            return None
+        return key_id(key)
+
+    def _tenant(self, identity):
+        key = self.resolve(identity)
+        tenant = self._tenants.get(key)
+        if tenant is None:
+            overrides = self.tenant_limits.get(key)
+            if overrides is None:
+                # Unconfigured callers keep the unlimited access they had before tenants existed;
+                # they still take their turn in the round-robin for slots
+                tenant = _Tenant(ANONYMOUS)
+            else:
+                limits = dict(self.default_limits)
+                limits.update({k: v for k, v in overrides.items() if k in limits})
+                # Never expose raw API keys in stats or logs
+                name = overrides.get('name') or (key if key == ANONYMOUS else key_id(key))
+                tenant = _Tenant(name, limits)
+            self._tenants[key] = tenant
+        return tenant
+
+    def check_rate(self, identity):
+        """Take one token from the tenant's bucket or raise AdmissionRejected"""
+        if not self.enabled:
+            return
+        with self._lock:
+            tenant = self._tenant(identity)
+            if not tenant.limited:
+                return
+            tenant.refill(time.monotonic())
+            if tenant.tokens < 1:
+                tenant.rejected_rate += 1
+                retry_after = (1 - tenant.tokens) / tenant.rate if tenant.rate > 0 else 60
+                raise AdmissionRejected(f"Rate limit exceeded for {tenant.name}", 429, retry_after)
+            tenant.tokens -= 1
+
+    def _enqueue(self, identity, waiter):
+        with self._lock:
+            tenant = self._tenant(identity)
+            if tenant.limited and tenant.in_flight + len(tenant.waiters) >= tenant.concurrency + tenant.max_queued:
+                tenant.rejected_concurrency += 1
+                raise AdmissionRejected(f"Too many concurrent requests for {tenant.name}", 429,
+                                        self._estimated_wait(tenant))
+            tenant.waiters.append(waiter)
+            self._dispatch()
+        return tenant
+
+    def _abandon(self, tenant, waiter):
+        """Give up waiting; returns True if the slot was granted in the meantime and must be used"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            tenant.waiters.remove(waiter)
+            tenant.timed_out += 1
+            return False
+
+    def _release(self, tenant):
+        with self._lock:
+            tenant.in_flight -= 1
+            self.free_slots += 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, identity):
+        """Wait for a fair share of the inference slots; rejects when the tenant has too much outstanding"""
+        if not self.enabled:
+            yield
+            return
+
+        waiter = _Waiter()
+        tenant = self._enqueue(identity, waiter)
+        if not waiter.event.wait(self.queue_timeout) and not self._abandon(tenant, waiter):
+            raise AdmissionRejected(f"Timed out waiting for a slot for {tenant.name}", 503,
+                                    self._estimated_wait(tenant))
+        try:
+            yield
+        finally:
+            self._release(tenant)
+
+    @asynccontextmanager
+    async def slot_async(self, identity):
+        """Same as slot() for event-loop callers: waiting for a slot does not hold a thread"""
+        if not self.enabled:
+            yield
+            return
+
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        waiter = _Waiter(on_grant=notify)
+        tenant = self._enqueue(identity, waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(tenant, waiter):
+                raise AdmissionRejected(f"Timed out waiting for a slot for {tenant.name}", 503,
+                                        self._estimated_wait(tenant))
+        except asyncio.CancelledError:
+            # A cancelled (disconnected) caller must not leak a slot granted in the meantime
+            if self._abandon(tenant, waiter):
+                self._release(tenant)
+            raise
+        try:
+            yield
+        finally:
+            self._release(tenant)
+
+    def _dispatch(self):
+        """Hand free slots to waiting tenants round-robin; called with the lock held"""
+        while self.free_slots > 0:
+            for identity, tenant in self._tenants.items():
+                if tenant.waiters and (not tenant.limited or tenant.in_flight < tenant.concurrency):
+                    break
+            else:
+                return
+            waiter = tenant.waiters.popleft()
+            tenant.in_flight += 1
+            tenant.admitted += 1
+            self.free_slots -= 1
+            self._tenants.move_to_end(identity)
+            waiter.grant()
+
+    def _estimated_wait(self, tenant):
+        # Rough hint: one token interval per request already outstanding for this tenant
+        outstanding = tenant.in_flight + len(tenant.waiters)
+        if not tenant.limited:
+            return outstanding / self.slots
+        return outstanding / tenant.rate if tenant.rate > 0 else 60
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            tenants = {}
+            for tenant in self._tenants.values():
+                tenant.refill(now)
+                tenants[tenant.name] = {
+                    'limited': tenant.limited,
+                    'rate': tenant.rate if tenant.limited else None,
+                    'burst': tenant.burst if tenant.limited else None,
+                    'tokens': round(tenant.tokens, 2) if tenant.limited else None,
+                    'concurrency': tenant.concurrency if tenant.limited else None,
+                    'in_flight': tenant.in_flight,
+                    'queued': len(tenant.waiters),
+                    'admitted': tenant.admitted,
+                    'rejected_rate': tenant.rejected_rate,
+                    'rejected_concurrency': tenant.rejected_concurrency,
+                    'timed_out': tenant.timed_out
+                }
+            return {
+                'enabled': self.enabled,
+                'slots': self.slots,
+                'free_slots': self.free_slots,
+                'queue_timeout': self.queue_timeout,
+                'tenants': tenants
+            }
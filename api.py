@@ -6,10 +6,10 @@ import json
 import tempfile
 from PIL import Image
 import torch
-from surya.ocr import run_ocr
 from surya.model.detection.model import load_model as load_det_model, load_processor as load_det_processor
 from surya.model.recognition.model import load_model as load_rec_model
 from surya.model.recognition.processor import load_processor as load_rec_processor
+from recognition_buckets import RecognitionBucketer, run_bucketed_ocr
 
 # Configure TorchDynamo
 torch._dynamo.config.capture_scalar_outputs = True
@@ -49,13 +49,27 @@ except Exception as e:
 
 # Compile recognition model
 logger.info("Compiling recognition model...")
+compiled = False
 try:
     rec_model.decoder.model = torch.compile(rec_model.decoder.model)
+    compiled = True
     logger.info("Recognition model compilation completed successfully")
 except Exception as e:
     logger.error(f"Error during recognition model compilation: {e}")
     logger.warning("Continuing without model compilation")
 
+# Pad recognition inputs to fixed shapes so the compiled decoder does not recompile per request;
+# an uncompiled decoder cannot recompile, so it gets no padding and no pre-warming
+recognition_bucketer = None
+if compiled:
+    recognition_bucketer = RecognitionBucketer.from_env(max_batch_size=int(os.environ["RECOGNITION_BATCH_SIZE"]))
+    logger.info("Pre-warming recognition buckets...")
+    try:
+        recognition_bucketer.prewarm(rec_model, rec_processor)
+        logger.info("Recognition buckets pre-warmed successfully")
+    except Exception as e:
+        logger.error(f"Error pre-warming recognition buckets: {e}")
+
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Image.Image):
@@ -70,10 +84,18 @@ def home():
         "status": "ok",
         "message": "Surya OCR API is running",
         "endpoints": {
-            "/ocr": "POST - Perform OCR on an image file"
+            "/ocr": "POST - Perform OCR on an image file",
+            "/stats": "GET - Recognition bucket, padding and recompile counters"
         }
     })
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "compiled": compiled,
+        "recognition_buckets": recognition_bucketer.stats() if recognition_bucketer is not None else None
+    })
+
 @app.route('/ocr', methods=['POST'])
 def ocr():
     try:
@@ -99,19 +121,20 @@ def ocr():
             logger.info(f"Image loaded: {image.size}")
             
             # Run OCR
-            predictions = run_ocr([image], [langs], det_model, det_processor, rec_model, rec_processor)
+            text_lines = run_bucketed_ocr([image], [langs], det_model, det_processor, rec_model, rec_processor,
+                                          recognition_bucketer)[0]
             
             # Format the OCR results
             results = {
-                'text': "\n".join([line.text for line in predictions[0].text_lines]),
+                'text': "\n".join([line['text'] for line in text_lines]),
                 'details': []
             }
             
             # Add detailed information about each text line
-            for line in predictions[0].text_lines:
+            for line in text_lines:
                 line_info = {
-                    'text': line.text,
-                    'bbox': line.bbox
+                    'text': line['text'],
+                    'bbox': line['bbox']
                 }
                 results['details'].append(line_info)
             
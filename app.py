@@ -2,51 +2,38 @@ import gradio as gr
 import logging
 import os
 import json
+import threading
 from PIL import Image, ImageDraw
-import torch
-from surya.ocr import run_ocr
 from surya.detection import batch_text_detection
 from surya.layout import batch_layout_detection
 from surya.ordering import batch_ordering
 from surya.model.detection.model import load_model as load_det_model, load_processor as load_det_processor
-from surya.model.recognition.model import load_model as load_rec_model
-from surya.model.recognition.processor import load_processor as load_rec_processor
 from surya.settings import settings
 from surya.model.ordering.processor import load_processor as load_order_processor
 from surya.model.ordering.model import load_model as load_order_model
 
-# Configuração do TorchDynamo
-torch._dynamo.config.capture_scalar_outputs = True
+# O serviço Flask configura o dispositivo, o TorchDynamo e os tamanhos de batch;
+# os modelos de detecção e reconhecimento são compartilhados com ele no mesmo processo
+import unified_app
 
-# Configuração de logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Configuração de variáveis de ambiente
-logger.info("Configurando variáveis de ambiente para otimização de performance")
-os.environ["RECOGNITION_BATCH_SIZE"] = "512"
-os.environ["DETECTOR_BATCH_SIZE"] = "36"
-os.environ["ORDER_BATCH_SIZE"] = "32"
-os.environ["RECOGNITION_STATIC_CACHE"] = "true"
+# Configuração de concorrência e batching do Gradio
+MAX_BATCH_SIZE = int(os.environ.get("GRADIO_MAX_BATCH_SIZE", "8"))
+DEFAULT_CONCURRENCY = int(os.environ.get("GRADIO_CONCURRENCY_LIMIT", "1"))
+OCR_CONCURRENCY = int(os.environ.get("GRADIO_OCR_CONCURRENCY", str(DEFAULT_CONCURRENCY)))
+DETECTION_CONCURRENCY = int(os.environ.get("GRADIO_DETECTION_CONCURRENCY", str(DEFAULT_CONCURRENCY)))
+LAYOUT_CONCURRENCY = int(os.environ.get("GRADIO_LAYOUT_CONCURRENCY", str(DEFAULT_CONCURRENCY)))
+SERVE_FLASK_API = os.environ.get("SERVE_FLASK_API", "true").lower() == "true"
+FLASK_PORT = int(os.environ.get("FLASK_PORT", "5000"))
 
 # Carregamento de modelos
 logger.info("Iniciando carregamento dos modelos...")
 
-try:
-    logger.debug("Carregando modelo e processador de detecção...")
-    det_processor, det_model = load_det_processor(), load_det_model()
-    logger.debug("Modelo e processador de detecção carregados com sucesso")
-except Exception as e:
-    logger.error(f"Erro ao carregar modelo de detecção: {e}")
-    raise
-
-try:
-    logger.debug("Carregando modelo e processador de reconhecimento...")
-    rec_model, rec_processor = load_rec_model(), load_rec_processor()
-    logger.debug("Modelo e processador de reconhecimento carregados com sucesso")
-except Exception as e:
-    logger.error(f"Erro ao carregar modelo de reconhecimento: {e}")
-    raise
+# Detecção e reconhecimento: mesmas instâncias usadas pelo serviço Flask; toda chamada a esses modelos
+# segura unified_app.detection_lock ou unified_app.recognition_lock
+unified_app.load_ocr_models()
+det_processor, det_model = unified_app.det_processor, unified_app.det_model
 
 try:
     logger.debug("Carregando modelo e processador de layout...")
@@ -68,15 +55,6 @@ except Exception as e:
 
 logger.info("Todos os modelos foram carregados com sucesso")
 
-# Compilação do modelo de reconhecimento
-logger.info("Iniciando compilação do modelo de reconhecimento...")
-try:
-    rec_model.decoder.model = torch.compile(rec_model.decoder.model)
-    logger.info("Compilação do modelo de reconhecimento concluída com sucesso")
-except Exception as e:
-    logger.error(f"Erro durante a compilação do modelo de reconhecimento: {e}")
-    logger.warning("Continuando sem compilação do modelo")
-
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Image.Image):
@@ -85,6 +63,12 @@ class CustomJSONEncoder(json.JSONEncoder):
             return {k: self.default(v) for k, v in obj.__dict__.items()}
         return str(obj)
 
+def load_image(file):
+    """Decode an uploaded file and close its handle right away"""
+    with Image.open(file.name) as source:
+        source.load()
+        return source.copy()
+
 def serialize_result(result):
     return json.dumps(result, cls=CustomJSONEncoder, indent=2)
 
@@ -104,38 +88,71 @@ def draw_boxes(image, predictions, color=(255, 0, 0)):
             draw.rectangle(bbox, outline=color, width=2)
     return image
 
-def ocr_workflow(image, langs):
-    logger.info(f"Iniciando workflow OCR com idiomas: {langs}")
+def draw_lines(image, text_lines, color=(255, 0, 0)):
+    """Draw the bbox of each text line dict returned by unified_app.recognize_images"""
+    draw = ImageDraw.Draw(image)
+    for line in text_lines:
+        draw.rectangle(line['bbox'], outline=color, width=2)
+    return image
+
+def load_batch(files):
+    """Decode a batch of uploads; returns the images that loaded and per-item errors"""
+    images, errors = [], []
+    for file in files:
+        try:
+            images.append(load_image(file))
+            errors.append(None)
+        except Exception as e:
+            logger.error(f"Erro ao carregar imagem: {e}")
+            images.append(None)
+            errors.append(str(e))
+    return images, errors
+
+def ocr_workflow(files, langs):
+    """Batched OCR handler: images from concurrent users go through one detection and one recognition call"""
+    logger.info(f"Iniciando workflow OCR para {len(files)} imagem(ns) com idiomas: {langs}")
+    images, errors = load_batch(files)
+    outputs = ([serialize_result({"error": error}) for error in errors], [None] * len(files), [""] * len(files))
+    valid = [i for i, image in enumerate(images) if image is not None]
+    if not valid:
+        return outputs
+    
     try:
-        image = Image.open(image.name)
-        logger.debug(f"Imagem carregada: {image.size}")
-        predictions = run_ocr([image], [langs.split(',')], det_model, det_processor, rec_model, rec_processor)
-        
-        # Draw bounding boxes on the image
-        image_with_boxes = draw_boxes(image.copy(), predictions[0].text_lines)
-        
-        # Format the OCR results
-        formatted_text = "\n".join([line.text for line in predictions[0].text_lines])
-        
+        # Same models, recognition buckets and locks as the Flask API; lines of images that share a
+        # language list are recognized together
+        batch_images = [images[i] for i in valid]
+        detections = unified_app.detect_images(batch_images)
+        predictions = unified_app.recognize_images(batch_images, detections, [langs[i].split(',') for i in valid])
+        for i, text_lines in zip(valid, predictions):
+            # Draw bounding boxes on the image
+            outputs[1][i] = draw_lines(images[i].copy(), text_lines)
+            # Format the OCR results
+            outputs[2][i] = "\n".join([line['text'] for line in text_lines])
+            outputs[0][i] = serialize_result({"text_lines": text_lines})
         logger.info("Workflow OCR concluído com sucesso")
-        return serialize_result(predictions), image_with_boxes, formatted_text
     except Exception as e:
         logger.error(f"Erro durante o workflow OCR: {e}")
-        return serialize_result({"error": str(e)}), None, ""
+        for i in valid:
+            outputs[0][i] = serialize_result({"error": str(e)})
+    return outputs
 
-def text_detection_workflow(image):
-    logger.info("Iniciando workflow de detecção de texto")
+def text_detection_workflow(files):
+    """Batched text detection handler"""
+    logger.info(f"Iniciando workflow de detecção de texto para {len(files)} imagem(ns)")
+    images, errors = load_batch(files)
+    outputs = ([serialize_result({"error": error}) for error in errors], [None] * len(files))
+    valid = [i for i, image in enumerate(images) if image is not None]
+    if not valid:
+        return outputs
+    
     try:
-        image = Image.open(image.name)
-        logger.debug(f"Imagem carregada: {image.size}")
-        predictions = batch_text_detection([image], det_model, det_processor)
-        
-        # Draw bounding boxes on the image
-        image_with_boxes = draw_boxes(image.copy(), predictions)
-        
-        # Convert predictions to a serializable format
-        serializable_predictions = []
-        for pred in predictions:
+        with unified_app.detection_lock:
+            predictions = batch_text_detection([images[i] for i in valid], det_model, det_processor)
+        for i, pred in zip(valid, predictions):
+            # Draw bounding boxes on the image
+            outputs[1][i] = draw_boxes(images[i].copy(), [pred])
+            
+            # Convert predictions to a serializable format
             serializable_pred = {
                 'bboxes': [bbox.tolist() if hasattr(bbox, 'tolist') else bbox for bbox in pred.bboxes],
                 'polygons': [poly.tolist() if hasattr(poly, 'tolist') else poly for poly in pred.polygons],
@@ -143,29 +160,34 @@ def text_detection_workflow(image):
                 'vertical_lines': [line.tolist() if hasattr(line, 'tolist') else line for line in pred.vertical_lines],
                 'image_bbox': pred.image_bbox.tolist() if hasattr(pred.image_bbox, 'tolist') else pred.image_bbox
             }
-            serializable_predictions.append(serializable_pred)
-        
+            outputs[0][i] = serialize_result([serializable_pred])
         logger.info("Workflow de detecção de texto concluído com sucesso")
-        return serialize_result(serializable_predictions), image_with_boxes
     except Exception as e:
         logger.error(f"Erro durante o workflow de detecção de texto: {e}")
-        return serialize_result({"error": str(e)}), None
+        for i in valid:
+            outputs[0][i] = serialize_result({"error": str(e)})
+    return outputs
 
-def layout_analysis_workflow(image):
-    logger.info("Iniciando workflow de análise de layout")
+def layout_analysis_workflow(files):
+    """Batched layout analysis handler"""
+    logger.info(f"Iniciando workflow de análise de layout para {len(files)} imagem(ns)")
+    images, errors = load_batch(files)
+    outputs = ([serialize_result({"error": error}) for error in errors], [None] * len(files))
+    valid = [i for i, image in enumerate(images) if image is not None]
+    if not valid:
+        return outputs
+    
     try:
-        image = Image.open(image.name)
-        logger.debug(f"Imagem carregada: {image.size}")
-        line_predictions = batch_text_detection([image], det_model, det_processor)
-        logger.debug(f"Detecção de linhas concluída. Número de linhas detectadas: {len(line_predictions[0].bboxes)}")
-        layout_predictions = batch_layout_detection([image], layout_model, layout_processor, line_predictions)
-        
-        # Draw bounding boxes on the image
-        image_with_boxes = draw_boxes(image.copy(), layout_predictions[0], color=(0, 255, 0))
-        
-        # Convert predictions to a serializable format
-        serializable_predictions = []
-        for pred in layout_predictions:
+        batch_images = [images[i] for i in valid]
+        with unified_app.detection_lock:
+            line_predictions = batch_text_detection(batch_images, det_model, det_processor)
+        logger.debug(f"Detecção de linhas concluída. Número de linhas detectadas: {[len(p.bboxes) for p in line_predictions]}")
+        layout_predictions = batch_layout_detection(batch_images, layout_model, layout_processor, line_predictions)
+        for i, pred in zip(valid, layout_predictions):
+            # Draw bounding boxes on the image
+            outputs[1][i] = draw_boxes(images[i].copy(), pred, color=(0, 255, 0))
+            
+            # Convert predictions to a serializable format
             serializable_pred = {
                 'bboxes': [
                     {
@@ -177,38 +199,46 @@ def layout_analysis_workflow(image):
                 ],
                 'image_bbox': pred.image_bbox.tolist() if hasattr(pred.image_bbox, 'tolist') else pred.image_bbox
             }
-            serializable_predictions.append(serializable_pred)
-        
+            outputs[0][i] = serialize_result([serializable_pred])
         logger.info("Workflow de análise de layout concluído com sucesso")
-        return serialize_result(serializable_predictions), image_with_boxes
     except Exception as e:
         logger.error(f"Erro durante o workflow de análise de layout: {e}")
-        return serialize_result({"error": str(e)}), None
+        for i in valid:
+            outputs[0][i] = serialize_result({"error": str(e)})
+    return outputs
 
-def reading_order_workflow(image):
-    logger.info("Iniciando workflow de ordem de leitura")
+def reading_order_workflow(files):
+    """Batched reading order handler"""
+    logger.info(f"Iniciando workflow de ordem de leitura para {len(files)} imagem(ns)")
+    images, errors = load_batch(files)
+    outputs = ([serialize_result({"error": error}) for error in errors], [None] * len(files))
+    valid = [i for i, image in enumerate(images) if image is not None]
+    if not valid:
+        return outputs
+    
     try:
-        image = Image.open(image.name)
-        logger.debug(f"Imagem carregada: {image.size}")
-        line_predictions = batch_text_detection([image], det_model, det_processor)
-        logger.debug(f"Detecção de linhas concluída. Número de linhas detectadas: {len(line_predictions[0].bboxes)}")
-        layout_predictions = batch_layout_detection([image], layout_model, layout_processor, line_predictions)
-        logger.debug(f"Análise de layout concluída. Número de elementos de layout: {len(layout_predictions[0].bboxes)}")
-        bboxes = [pred.bbox for pred in layout_predictions[0].bboxes]
-        order_predictions = batch_ordering([image], [bboxes], order_model, order_processor)
-        
-        # Draw bounding boxes on the image
-        image_with_boxes = image.copy()
-        draw = ImageDraw.Draw(image_with_boxes)
-        for i, bbox in enumerate(order_predictions[0].bboxes):
-            draw.rectangle(bbox.bbox, outline=(0, 0, 255), width=2)
-            draw.text((bbox.bbox[0], bbox.bbox[1]), str(bbox.position), fill=(255, 0, 0))
-        
+        batch_images = [images[i] for i in valid]
+        with unified_app.detection_lock:
+            line_predictions = batch_text_detection(batch_images, det_model, det_processor)
+        layout_predictions = batch_layout_detection(batch_images, layout_model, layout_processor, line_predictions)
+        logger.debug(f"Análise de layout concluída. Número de elementos de layout: {[len(p.bboxes) for p in layout_predictions]}")
+        bboxes = [[pred.bbox for pred in layout.bboxes] for layout in layout_predictions]
+        order_predictions = batch_ordering(batch_images, bboxes, order_model, order_processor)
+        for i, order in zip(valid, order_predictions):
+            # Draw bounding boxes on the image
+            image_with_boxes = images[i].copy()
+            draw = ImageDraw.Draw(image_with_boxes)
+            for bbox in order.bboxes:
+                draw.rectangle(bbox.bbox, outline=(0, 0, 255), width=2)
+                draw.text((bbox.bbox[0], bbox.bbox[1]), str(bbox.position), fill=(255, 0, 0))
+            outputs[1][i] = image_with_boxes
+            outputs[0][i] = serialize_result([order])
         logger.info("Workflow de ordem de leitura concluído com sucesso")
-        return serialize_result(order_predictions), image_with_boxes
     except Exception as e:
         logger.error(f"Erro durante o workflow de ordem de leitura: {e}")
-        return serialize_result({"error": str(e)}), None
+        for i in valid:
+            outputs[0][i] = serialize_result({"error": str(e)})
+    return outputs
 
 with gr.Blocks(theme=gr.themes.Soft()) as demo:
     gr.Markdown("# Análise de Documentos com Surya")
@@ -222,7 +252,9 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         ocr_output = gr.JSON(label="Resultados OCR")
         ocr_image = gr.Image(label="Imagem com Bounding Boxes")
         ocr_text = gr.Textbox(label="Texto Extraído", lines=10)
-        ocr_button.click(ocr_workflow, inputs=[ocr_input, ocr_langs], outputs=[ocr_output, ocr_image, ocr_text])
+        ocr_button.click(ocr_workflow, inputs=[ocr_input, ocr_langs], outputs=[ocr_output, ocr_image, ocr_text],
+                         batch=True, max_batch_size=MAX_BATCH_SIZE,
+                         concurrency_limit=OCR_CONCURRENCY, concurrency_id="ocr")
 
     with gr.Tab("Detecção de Texto"):
         gr.Markdown("## Detecção de Linhas de Texto")
@@ -230,7 +262,9 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         det_button = gr.Button("Executar Detecção de Texto")
         det_output = gr.JSON(label="Resultados da Detecção de Texto")
         det_image = gr.Image(label="Imagem com Bounding Boxes")
-        det_button.click(text_detection_workflow, inputs=det_input, outputs=[det_output, det_image])
+        det_button.click(text_detection_workflow, inputs=det_input, outputs=[det_output, det_image],
+                         batch=True, max_batch_size=MAX_BATCH_SIZE,
+                         concurrency_limit=DETECTION_CONCURRENCY, concurrency_id="detection")
 
     with gr.Tab("Análise de Layout"):
         gr.Markdown("## Análise de Layout e Ordem de Leitura")
@@ -241,9 +275,26 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         layout_image = gr.Image(label="Imagem com Layout")
         order_output = gr.JSON(label="Resultados da Ordem de Leitura")
         order_image = gr.Image(label="Imagem com Ordem de Leitura")
-        layout_button.click(layout_analysis_workflow, inputs=layout_input, outputs=[layout_output, layout_image])
-        order_button.click(reading_order_workflow, inputs=layout_input, outputs=[order_output, order_image])
+        layout_button.click(layout_analysis_workflow, inputs=layout_input, outputs=[layout_output, layout_image],
+                            batch=True, max_batch_size=MAX_BATCH_SIZE,
+                            concurrency_limit=LAYOUT_CONCURRENCY, concurrency_id="layout")
+        order_button.click(reading_order_workflow, inputs=layout_input, outputs=[order_output, order_image],
+                           batch=True, max_batch_size=MAX_BATCH_SIZE,
+                           concurrency_limit=LAYOUT_CONCURRENCY, concurrency_id="layout")
+
+demo.queue(default_concurrency_limit=DEFAULT_CONCURRENCY)
 
 if __name__ == "__main__":
+    if SERVE_FLASK_API:
+        # A API Flask roda no mesmo processo e reutiliza os modelos já carregados
+        logger.info(f"Iniciando API Flask na porta {FLASK_PORT}...")
+        flask_thread = threading.Thread(
+            target=unified_app.app.run,
+            kwargs={'host': '0.0.0.0', 'port': FLASK_PORT, 'debug': False, 'threaded': True, 'use_reloader': False},
+            name='flask-api',
+            daemon=True
+        )
+        flask_thread.start()
+    
     logger.info("Iniciando aplicativo Gradio...")
     demo.launch()
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""
+ASGI entry point for the OCR service.
+
+Upload reception, multipart parsing, image header validation and response
+streaming run on the event loop, so slow clients and idle keep-alive
+connections do not pin a worker thread each. Only inference is handed to a
+bounded executor sized to the admission slots; requests waiting for a slot
+wait on the loop as well. /api/ocr, /api/device-info, /pdf/<filename> and
+/static keep the Flask contracts, every other route is served by the Flask
+app mounted underneath.
+
+    python asgi_app.py          # or: uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+import os
+import uuid
+import shutil
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, FileResponse
+from starlette.routing import Route, Mount
+from starlette.staticfiles import StaticFiles
+from werkzeug.utils import secure_filename, safe_join
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import unified_app
+from unified_app import (app as flask_app, admission_controller, memory_governor, ocr_flights, allowed_file,
+                         parse_ocr_options, run_ocr_job, ocr_error, ocr_flight_key, device_info_payload,
+                         OcrRequestError, MAX_CONTENT_LENGTH)
+from admission import AdmissionController
+
+logger = logging.getLogger(__name__)
+
+# Inference threads; defaults to the number of admission slots so the executor never queues behind them
+ASGI_INFERENCE_WORKERS = int(os.environ.get("ASGI_INFERENCE_WORKERS", str(admission_controller.slots)))
+ASGI_HOST = os.environ.get("ASGI_HOST", "0.0.0.0")
+ASGI_PORT = int(os.environ.get("ASGI_PORT", "5000"))
+ASGI_KEEP_ALIVE = int(os.environ.get("ASGI_KEEP_ALIVE", "30"))
+
+inference_executor = ThreadPoolExecutor(max_workers=ASGI_INFERENCE_WORKERS, thread_name_prefix='ocr-inference')
+
+def error_response(e):
+    body, status, headers = ocr_error(e)
+    return JSONResponse(body, status_code=status, headers=headers)
+
+def draining_response():
+    return JSONResponse({'error': f"Worker is draining ({memory_governor.drain_reason})"},
+                        status_code=503, headers={'Retry-After': '5'})
+
+class UploadTooLarge(Exception):
+    """Raised while receiving a request body that exceeds MAX_CONTENT_LENGTH"""
+
+def limit_body(receive, limit):
+    """Wrap an ASGI receive callable so the body is cut off as soon as it exceeds limit bytes"""
+    received = 0
+
+    async def limited_receive():
+        nonlocal received
+        message = await receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > limit:
+                raise UploadTooLarge()
+        return message
+
+    return limited_receive
+
+def remove_upload(file_path):
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+def save_upload(source, file_path):
+    source.seek(0)
+    with open(file_path, 'wb') as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+
+async def receive_upload(form, request):
+    """Validate the uploaded image and OCR options and save the file; raises OcrRequestError"""
+    file = form.get('image')
+    # Check if the post request has the file part
+    if file is None or isinstance(file, str):
+        raise OcrRequestError('No image part')
+
+    # If user does not select a file
+    if not file.filename:
+        raise OcrRequestError('No selected file')
+
+    if not allowed_file(file.filename):
+        raise OcrRequestError('Invalid file format')
+
+    if file.size is not None and file.size > MAX_CONTENT_LENGTH:
+        raise OcrRequestError('Upload too large', 413)
+
+    options = parse_ocr_options(form, request.query_params, request.headers)
+
+    # Reject undecodable uploads before they take an inference slot; only the header is parsed
+    try:
+        file.file.seek(0)
+        with Image.open(file.file) as probe:
+            width, height = probe.size
+        if width <= 0 or height <= 0:
+            raise ValueError(f"invalid size {width}x{height}")
+    except Exception as e:
+        logger.info(f"Rejecting undecodable upload {file.filename}: {e}")
+        raise OcrRequestError("Uploaded file is not a readable image")
+
+    # Create a secure filename
+    filename = secure_filename(file.filename)
+    unique_filename = f"{uuid.uuid4().hex}_{filename}"
+    file_path = os.path.join(flask_app.config['UPLOAD_FOLDER'], unique_filename)
+
+    # Save the file temporarily
+    await run_in_threadpool(save_upload, file.file, file_path)
+    return filename, file_path, options
+
+async def api_ocr(request):
+    """API endpoint for OCR processing"""
+    if memory_governor.draining:
+        return draining_response()
+
+    # Enforce the caller's rate limit before the upload is read
+    tenant = AdmissionController.identify(request.headers, request.query_params)
+    owner = admission_controller.owner_id(request.headers)
+    try:
+        admission_controller.check_rate(tenant)
+    except Exception as e:
+        return error_response(e)
+
+    try:
+        declared_length = int(request.headers.get('content-length', 0))
+    except ValueError:
+        return JSONResponse({'error': 'Invalid Content-Length'}, status_code=400)
+    if declared_length > MAX_CONTENT_LENGTH:
+        return JSONResponse({'error': 'Upload too large'}, status_code=413)
+
+    # The body is received on the loop and spooled to a temporary file; chunked uploads carry no
+    # Content-Length, so the limit is also enforced on the bytes actually received
+    request = Request(request.scope, limit_body(request.receive, MAX_CONTENT_LENGTH))
+    try:
+        form = await request.form(max_files=1, max_fields=16)
+    except UploadTooLarge:
+        return JSONResponse({'error': 'Upload too large'}, status_code=413)
+    except Exception as e:
+        return JSONResponse({'error': f"Invalid multipart body: {e}"}, status_code=400)
+    try:
+        filename, file_path, (langs, mode, profile_mode, debug_mode) = await receive_upload(form, request)
+    except Exception as e:
+        return error_response(e)
+    finally:
+        await form.close()
+
+    # Once its OCR run has started the run owns the upload: a shared run outlives a leader that disconnected
+    started = False
+
+    # Wait for a fair share of the inference slots on the loop, then run OCR on the executor
+    async def admitted_job():
+        try:
+            async with admission_controller.slot_async(tenant):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(inference_executor, functools.partial(
+                    run_ocr_job, file_path, filename, langs, mode, profile_mode, debug_mode, owner))
+        finally:
+            remove_upload(file_path)
+
+    def start_job():
+        nonlocal started
+        started = True
+        return admitted_job()
+
+    try:
+        # Retries that arrive while the same image is still being processed wait for that run instead
+        key = await run_in_threadpool(ocr_flight_key, file_path, tenant, langs, mode, profile_mode, debug_mode)
+        if key is not None:
+            response, _ = await ocr_flights.do_async(key, start_job)
+        else:
+            response = await start_job()
+        return JSONResponse(response)
+
+    except Exception as e:
+        return error_response(e)
+    finally:
+        # Clean up the uploaded file unless a run took it over
+        if not started:
+            remove_upload(file_path)
+
+async def device_info(request):
+    """Get device information (CPU/GPU)"""
+    return JSONResponse(device_info_payload())
+
+async def serve_pdf(request):
+    """Serve a PDF file from the PDF folder"""
+    filename = request.path_params['filename']
+    pdf_path = safe_join(flask_app.config['PDF_FOLDER'], filename)
+    if pdf_path is None or not os.path.isfile(pdf_path):
+        logger.error(f"PDF file not found: {filename}")
+        return JSONResponse({'error': 'Not Found'}, status_code=404)
+    return FileResponse(pdf_path, media_type='application/pdf')
+
+@asynccontextmanager
+async def lifespan(app):
+    logger.info("Starting Surya OCR ASGI server")
+    await run_in_threadpool(unified_app.load_ocr_models)
+    logger.info(f"Models loaded, running inference on {ASGI_INFERENCE_WORKERS} executor thread(s)")
+    try:
+        yield
+    finally:
+        inference_executor.shutdown(wait=False)
+
+app = Starlette(
+    routes=[
+        Route('/api/ocr', api_ocr, methods=['POST']),
+        Route('/api/device-info', device_info),
+        Route('/pdf/{filename}', serve_pdf),
+        Mount('/static', StaticFiles(directory=flask_app.static_folder), name='static'),
+        # Index page, search and admin endpoints stay on Flask
+        Mount('/', WSGIMiddleware(flask_app))
+    ],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host=ASGI_HOST, port=ASGI_PORT, timeout_keep_alive=ASGI_KEEP_ALIVE)
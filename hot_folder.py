@@ -0,0 +1,356 @@
+"""
+Hot-folder daemon: OCR every image dropped into an inbox directory.
+
+New files are picked up through inotify when the optional inotify_simple
+package is installed, otherwise (and on network shares, where inotify sees
+nothing) by polling. A file is taken as soon as inotify reports it closed,
+or once it has not been modified for the settle time. Ready files are
+processed in batches through the models loaded once by unified_app, then
+moved with their results into the done folder, or with an error note into
+the failed folder.
+
+Every claimed file is recorded in a SQLite ledger, keyed by name and
+content hash, before any work is done. After a crash or restart, files that
+finished are never processed again and files that were in flight are
+picked up again; a file that keeps killing the daemon is moved to the
+failed folder after --max-attempts tries.
+
+    python hot_folder.py /srv/scans --langs tr,en --batch-size 8
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import sqlite3
+import hashlib
+import logging
+import argparse
+
+import unified_app
+
+logger = logging.getLogger(__name__)
+
+# Partial downloads and editor/scanner temp files are never picked up
+TEMPORARY_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload', '.filepart')
+
+
+class PollingWatcher:
+    """Wakes the daemon every poll interval; the directory scan does the actual work"""
+    name = 'polling'
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return set()
+
+
+class InotifyWatcher:
+    """Wakes the daemon as soon as a file is closed after writing or moved into the inbox"""
+    name = 'inotify'
+
+    def __init__(self, directory):
+        from inotify_simple import INotify, flags
+        self._inotify = INotify()
+        self._inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO)
+
+    def wait(self, timeout):
+        # Names reported here were closed or renamed into place, so they need no settle time
+        return {event.name for event in self._inotify.read(timeout=int(timeout * 1000)) if event.name}
+
+
+def create_watcher(directory, use_inotify=True):
+    if use_inotify:
+        try:
+            return InotifyWatcher(directory)
+        except (ImportError, OSError) as e:
+            logger.warning(f"inotify unavailable ({e}), falling back to polling")
+    return PollingWatcher()
+
+
+class Ledger:
+    """Persistent record of every file the daemon has claimed"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                name TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                size INTEGER,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                destination TEXT,
+                error TEXT,
+                updated_at REAL,
+                PRIMARY KEY (name, digest)
+            )''')
+        self._conn.commit()
+
+    def get(self, name, digest):
+        return self._conn.execute('SELECT * FROM files WHERE name = ? AND digest = ?', (name, digest)).fetchone()
+
+    def claim(self, name, digest, size, destination):
+        """Mark a file as being processed before any work starts; returns the attempt number"""
+        with self._conn:
+            self._conn.execute('''
+                INSERT INTO files (name, digest, size, status, attempts, destination, updated_at)
+                VALUES (?, ?, ?, 'processing', 1, ?, ?)
+                ON CONFLICT (name, digest) DO UPDATE SET
+                    status = 'processing', attempts = attempts + 1, destination = excluded.destination,
+                    error = NULL, updated_at = excluded.updated_at''',
+                (name, digest, size, destination, time.time()))
+        return self.get(name, digest)['attempts']
+
+    def finish(self, name, digest, status, destination, error=None):
+        with self._conn:
+            self._conn.execute('''
+                UPDATE files SET status = ?, destination = ?, error = ?, updated_at = ?
+                WHERE name = ? AND digest = ?''', (status, destination, error, time.time(), name, digest))
+
+    def interrupted(self):
+        """Files that were being processed when the daemon last stopped"""
+        return self._conn.execute("SELECT * FROM files WHERE status = 'processing'").fetchall()
+
+    def stats(self):
+        rows = self._conn.execute('SELECT status, COUNT(*) AS count FROM files GROUP BY status').fetchall()
+        return {row['status']: row['count'] for row in rows}
+
+    def close(self):
+        self._conn.close()
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(path, data):
+    """Write a result file so readers never see it half-written"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def move_atomic(source, destination):
+    """Move a file so it exists in exactly one place at any time, also across filesystems"""
+    try:
+        os.replace(source, destination)
+    except OSError:
+        temp_path = f"{destination}.tmp"
+        shutil.copy2(source, temp_path)
+        with open(temp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(temp_path, destination)
+        os.remove(source)
+
+
+def unique_destination(directory, name, digest):
+    """Keep the original name unless another file, or the results of one with the same stem, already has it"""
+    stem, ext = os.path.splitext(name)
+    destination = os.path.join(directory, name)
+    if os.path.exists(destination) or os.path.exists(os.path.join(directory, f"{stem}_ocr.json")):
+        destination = os.path.join(directory, f"{stem}_{digest[:8]}{ext}")
+    return destination
+
+
+class HotFolder:
+    """Watches an inbox and runs every settled image through OCR exactly once"""
+
+    def __init__(self, inbox, done_dir=None, failed_dir=None, langs='tr,en', mode=None, batch_size=8,
+                 poll_interval=2.0, settle_seconds=2.0, max_attempts=2, ledger_path=None, use_inotify=True):
+        self.inbox = os.path.abspath(inbox)
+        self.done_dir = os.path.abspath(done_dir or os.path.join(self.inbox, 'done'))
+        self.failed_dir = os.path.abspath(failed_dir or os.path.join(self.inbox, 'failed'))
+        self.langs = langs
+        self.mode = mode
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.max_attempts = max(1, max_attempts)
+        for directory in (self.done_dir, self.failed_dir):
+            os.makedirs(directory, exist_ok=True)
+        self.ledger = Ledger(ledger_path or os.path.join(self.inbox, '.ocr_ledger.db'))
+        self.watcher = create_watcher(self.inbox, use_inotify)
+        # Names inotify reported as closed after writing
+        self._closed = set()
+        self._stopping = False
+        self.processed = 0
+        self.failed = 0
+
+    def stop(self, *args):
+        logger.info("Stopping after the current batch")
+        self._stopping = True
+
+    def recover(self):
+        """Settle files left 'processing' by a crash whose input already reached the done folder"""
+        for row in self.ledger.interrupted():
+            in_inbox = os.path.exists(os.path.join(self.inbox, row['name']))
+            if not in_inbox and row['destination'] and os.path.exists(row['destination']):
+                self.ledger.finish(row['name'], row['digest'], 'done', row['destination'])
+                logger.info(f"Recovered {row['name']}: finished before the restart")
+            elif in_inbox:
+                logger.info(f"Recovered {row['name']}: interrupted on attempt {row['attempts']}, will retry")
+
+    def candidates(self, closed_names):
+        """
+        Scan the inbox for image files that have stopped changing.
+
+        Returns (ready, pending): names ready to process, oldest first, and
+        the number of files that are still being written.
+        """
+        now = time.time()
+        self._closed |= closed_names
+        ready, names, pending = [], set(), 0
+        for entry in os.scandir(self.inbox):
+            name = entry.name
+            if (not entry.is_file() or name.startswith(('.', '~')) or name.lower().endswith(TEMPORARY_SUFFIXES)
+                    or not unified_app.allowed_file(name)):
+                continue
+            names.add(name)
+            stat = entry.stat()
+            # Closed after writing (inotify), or untouched for the settle time (polling)
+            if stat.st_size > 0 and (name in self._closed or now - stat.st_mtime >= self.settle_seconds):
+                ready.append((stat.st_mtime, name))
+            else:
+                pending += 1
+        self._closed &= names
+        return [name for _, name in sorted(ready)], pending
+
+    def claim_batch(self, ready):
+        """Claim up to batch_size files in the ledger; finished duplicates and poison files are moved right away"""
+        batch, stems = [], set()
+        for name in ready:
+            if len(batch) >= self.batch_size:
+                break
+            # process_ocr names the PDF after the file stem, so one stem per batch
+            stem = os.path.splitext(name)[0]
+            if stem in stems:
+                continue
+            path = os.path.join(self.inbox, name)
+            try:
+                digest = file_digest(path)
+            except OSError as e:
+                logger.warning(f"Cannot read {name}: {e}")
+                continue
+            row = self.ledger.get(name, digest)
+            if row is not None and row['status'] == 'done':
+                destination = unique_destination(self.done_dir, name, digest)
+                move_atomic(path, destination)
+                logger.info(f"{name} was already processed, moved to {destination} without OCR")
+                continue
+            if row is not None and row['status'] == 'processing' and row['attempts'] >= self.max_attempts:
+                self.fail(name, digest, path, f"Gave up after {row['attempts']} interrupted attempts")
+                continue
+
+            destination = unique_destination(self.done_dir, name, digest)
+            self.ledger.claim(name, digest, os.path.getsize(path), destination)
+            batch.append((name, digest, path, destination))
+            stems.add(stem)
+        return batch
+
+    def fail(self, name, digest, path, error):
+        destination = unique_destination(self.failed_dir, name, digest)
+        write_atomic(f"{os.path.splitext(destination)[0]}_error.txt", f"{error}\n")
+        move_atomic(path, destination)
+        self.ledger.finish(name, digest, 'failed', destination, error)
+        self.failed += 1
+        logger.error(f"Failed {name}: {error}")
+
+    def complete(self, name, digest, path, destination, ocr_result):
+        """Write the results next to the final location of the input, then move the input there"""
+        base = os.path.splitext(destination)[0]
+        pdf_url = ocr_result.get('pdfUrl', '')
+        if pdf_url:
+            pdf_path = os.path.join(unified_app.app.config['PDF_FOLDER'], os.path.basename(pdf_url))
+            if os.path.exists(pdf_path):
+                move_atomic(pdf_path, f"{base}_ocr.pdf")
+        write_atomic(f"{base}_ocr.txt", ocr_result.get('text', ''))
+        write_atomic(f"{base}_ocr.json", json.dumps({
+            'source': name,
+            'sha256': digest,
+            'langs': self.langs,
+            'text': ocr_result.get('text', ''),
+            'text_lines': ocr_result.get('text_lines', []),
+            'ocr_stats': ocr_result.get('ocr_stats', {})
+        }, ensure_ascii=False, indent=2, cls=unified_app.CustomJSONEncoder))
+        move_atomic(path, destination)
+        self.ledger.finish(name, digest, 'done', destination)
+        self.processed += 1
+
+    def process_batch(self, batch):
+        started = time.time()
+        results = unified_app.process_ocr_batch([path for _, _, path, _ in batch], self.langs, self.mode)
+        for (name, digest, path, destination), result in zip(batch, results):
+            if isinstance(result, Exception):
+                self.fail(name, digest, path, str(result))
+                continue
+            try:
+                self.complete(name, digest, path, destination, result)
+            except Exception as e:
+                self.fail(name, digest, path, f"Could not store results: {e}")
+        elapsed = time.time() - started
+        logger.info(f"Processed {len(batch)} file(s) in {elapsed:.2f}s ({len(batch) / max(elapsed, 1e-6):.2f} files/s)")
+
+    def run(self, once=False):
+        logger.info(f"Watching {self.inbox} ({self.watcher.name}), done: {self.done_dir}, failed: {self.failed_dir}")
+        self.recover()
+        closed_names = set()
+        while not self._stopping:
+            ready, pending = self.candidates(closed_names)
+            batch = self.claim_batch(ready)
+            if batch:
+                self.process_batch(batch)
+                closed_names = set()
+                # More work may already be waiting; look again without sleeping
+                continue
+            if once and not pending:
+                break
+            closed_names = self.watcher.wait(self.poll_interval)
+        logger.info(f"Hot folder stopped: {self.processed} processed, {self.failed} failed, ledger {self.ledger.stats()}")
+        self.ledger.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot-folder OCR daemon")
+    parser.add_argument("inbox", help="Directory the scanners drop files into")
+    parser.add_argument("--done", help="Directory for processed files and their results (default: INBOX/done)")
+    parser.add_argument("--failed", help="Directory for files that could not be processed (default: INBOX/failed)")
+    parser.add_argument("--langs", default="tr,en", help="Languages (comma-separated, default: tr,en)")
+    parser.add_argument("--mode", choices=['fast', 'accurate'], help="OCR mode (default: OCR_DEFAULT_MODE)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Files per batch (default: 8)")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between scans (default: 2)")
+    parser.add_argument("--settle-seconds", type=float, default=2.0,
+                        help="Seconds a polled file must stay unchanged before it is taken (default: 2)")
+    parser.add_argument("--max-attempts", type=int, default=2,
+                        help="Interrupted attempts before a file is moved to failed (default: 2)")
+    parser.add_argument("--ledger", help="Ledger database (default: INBOX/.ocr_ledger.db)")
+    parser.add_argument("--no-inotify", action="store_true", help="Always poll, e.g. on network shares")
+    parser.add_argument("--once", action="store_true", help="Process the files already in the inbox and exit")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.inbox):
+        parser.error(f"{args.inbox} is not a directory")
+
+    hot_folder = HotFolder(args.inbox, args.done, args.failed, args.langs, args.mode, args.batch_size,
+                           args.poll_interval, args.settle_seconds, args.max_attempts, args.ledger,
+                           use_inotify=not args.no_inotify)
+    signal.signal(signal.SIGTERM, hot_folder.stop)
+    signal.signal(signal.SIGINT, hot_folder.stop)
+
+    unified_app.load_ocr_models()
+    hot_folder.run(once=args.once)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
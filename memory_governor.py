@@ -0,0 +1,385 @@
+"""
+Memory governance for the OCR service.
+
+Tracks resident memory (and CUDA memory when available) per request and per
+processing stage, predicts the cost of an image before it is decoded so that
+oversized uploads can be downscaled or rejected, and drains/recycles the
+worker after a number of requests or once RSS crosses a threshold.
+"""
+import gc
+import os
+import signal
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when an image is predicted to exceed the per-request memory budget"""
+
+
+class WorkerDraining(Exception):
+    """Raised when the worker no longer accepts requests because it is being recycled"""
+
+
+def current_rss_bytes():
+    """Return the current resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        # Not available on Windows; ru_maxrss is a peak, which is the best we can do here
+        import resource
+        import platform
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == 'Darwin' else peak * 1024
+    except Exception:
+        return 0
+
+
+def _cuda_available():
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except Exception:
+        return False
+
+
+def _env_float(name, default=None):
+    value = os.environ.get(name, '')
+    if value == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid value for {name}: {value}")
+        return default
+
+
+class _StageWindow:
+    """RSS samples collected while a stage is running"""
+    def __init__(self, start_rss):
+        self.peak_rss = start_rss
+
+
+class RequestMemory:
+    """Memory accounting for a single request, broken down per stage"""
+    def __init__(self, governor, label):
+        self.governor = governor
+        self.label = label
+        self.started_at = time.time()
+        self.start_rss = current_rss_bytes()
+        self.peak_rss = self.start_rss
+        self.cuda_peak = 0
+        self.stages = {}
+        self.downscale_factor = 1.0
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Record wall time, RSS peak and CUDA peak for one processing stage.
+
+        The CUDA peak counter is process-wide, so a stage that overlapped with
+        any other stage (of this or another request) reports None for it.
+        """
+        start_rss = current_rss_bytes()
+        window = _StageWindow(start_rss)
+        cuda_window = self.governor._enter_cuda_window() if self.governor.track_cuda else None
+
+        self.governor._add_window(window)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.governor._remove_window(window)
+            end_rss = current_rss_bytes()
+            window.peak_rss = max(window.peak_rss, end_rss)
+            cuda_peak = self.governor._exit_cuda_window(cuda_window) if cuda_window is not None else 0
+
+            self.peak_rss = max(self.peak_rss, window.peak_rss)
+            if cuda_peak is not None:
+                self.cuda_peak = max(self.cuda_peak, cuda_peak)
+            self.stages[name] = {
+                'seconds': round(time.time() - start, 3),
+                'rss_start_mb': round(start_rss / MB, 1),
+                'rss_end_mb': round(end_rss / MB, 1),
+                'peak_rss_mb': round(window.peak_rss / MB, 1),
+                'cuda_peak_mb': round(cuda_peak / MB, 1) if cuda_peak is not None else None
+            }
+
+    def summary(self):
+        return {
+            'request': self.label,
+            'seconds': round(time.time() - self.started_at, 3),
+            'peak_rss_mb': round(self.peak_rss / MB, 1),
+            'rss_growth_mb': round((current_rss_bytes() - self.start_rss) / MB, 1),
+            'cuda_peak_mb': round(self.cuda_peak / MB, 1),
+            'downscale_factor': self.downscale_factor,
+            'stages': self.stages
+        }
+
+
+class MemoryGovernor:
+    """Per-request memory accounting, image admission and worker recycling"""
+
+    def __init__(self, budget_mb=None, bytes_per_pixel=40.0, oversize_policy='downscale',
+                 max_requests=None, max_rss_mb=None, recycle_grace_seconds=2.0,
+                 sample_interval=0.05, gc_after_request=True, history_size=20):
+        self.budget_bytes = budget_mb * MB if budget_mb else None
+        self.bytes_per_pixel = bytes_per_pixel
+        self.oversize_policy = oversize_policy
+        self.max_requests = int(max_requests) if max_requests else None
+        self.max_rss_bytes = max_rss_mb * MB if max_rss_mb else None
+        self.recycle_grace_seconds = recycle_grace_seconds
+        self.sample_interval = sample_interval
+        self.gc_after_request = gc_after_request
+        self.track_cuda = _cuda_available()
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._windows = set()
+        # Stages inside a CUDA window, and how many windows were ever opened (to detect overlaps)
+        self._cuda_stages = 0
+        self._cuda_windows_opened = 0
+        self._sampler = None
+        self._recycle_scheduled = False
+
+        self.in_flight = 0
+        self.requests_served = 0
+        self.requests_rejected = 0
+        self.images_downscaled = 0
+        self.peak_rss = current_rss_bytes()
+        self.draining = False
+        self.drain_reason = None
+        self.stage_peaks = {}
+        self.history = deque(maxlen=history_size)
+
+    @classmethod
+    def from_env(cls):
+        """Build a governor from OCR_MEMORY_* and WORKER_* environment variables"""
+        return cls(
+            budget_mb=_env_float('OCR_MEMORY_BUDGET_MB'),
+            bytes_per_pixel=_env_float('OCR_MEMORY_BYTES_PER_PIXEL', 40.0),
+            oversize_policy=os.environ.get('OCR_OVERSIZE_POLICY', 'downscale').lower(),
+            max_requests=_env_float('WORKER_MAX_REQUESTS'),
+            max_rss_mb=_env_float('WORKER_MAX_RSS_MB'),
+            recycle_grace_seconds=_env_float('WORKER_RECYCLE_GRACE_SECONDS', 2.0),
+            gc_after_request=os.environ.get('OCR_GC_AFTER_REQUEST', 'true').lower() == 'true'
+        )
+
+    # Image admission
+
+    def estimate_image_bytes(self, size):
+        """Predict the peak working memory needed to OCR an image of the given size"""
+        width, height = size
+        return int(width * height * self.bytes_per_pixel)
+
+    def admit_image(self, size):
+        """
+        Check an image against the memory budget before it is decoded.
+
+        Returns the factor the image has to be scaled by (1.0 when it fits) or
+        raises MemoryBudgetExceeded when the policy is to reject oversized images.
+        """
+        if not self.budget_bytes:
+            return 1.0
+
+        predicted = self.estimate_image_bytes(size)
+        if predicted <= self.budget_bytes:
+            return 1.0
+
+        if self.oversize_policy == 'reject':
+            with self._lock:
+                self.requests_rejected += 1
+            raise MemoryBudgetExceeded(
+                f"Image {size[0]}x{size[1]} needs ~{predicted / MB:.0f}MB, "
+                f"budget is {self.budget_bytes / MB:.0f}MB"
+            )
+
+        factor = (self.budget_bytes / predicted) ** 0.5
+        with self._lock:
+            self.images_downscaled += 1
+        request_memory = self.current()
+        if request_memory is not None:
+            request_memory.downscale_factor = round(factor, 4)
+        logger.warning(f"Image {size[0]}x{size[1]} predicted at ~{predicted / MB:.0f}MB, downscaling by {factor:.3f}")
+        return factor
+
+    # Request accounting
+
+    def current(self):
+        """Return the RequestMemory of the request running on this thread, if any"""
+        return getattr(self._local, 'request', None)
+
+    def stage(self, name):
+        """Stage context for the current request; a no-op outside of a tracked request"""
+        request_memory = self.current()
+        if request_memory is None:
+            return nullcontext()
+        return request_memory.stage(name)
+
+    @contextmanager
+    def bind(self, request_memory):
+        """Account work on this thread to a request started on another one (pipeline stage threads)"""
+        previous = self.current()
+        self._local.request = request_memory
+        try:
+            yield request_memory
+        finally:
+            self._local.request = previous
+
+    @contextmanager
+    def request(self, label=''):
+        """Track one request: refuse it while draining, account memory, then release"""
+        with self._lock:
+            if self.draining:
+                self.requests_rejected += 1
+                raise WorkerDraining(f"Worker is draining ({self.drain_reason})")
+            self.in_flight += 1
+
+        request_memory = RequestMemory(self, label)
+        self._local.request = request_memory
+        self._ensure_sampler()
+        try:
+            yield request_memory
+        finally:
+            self._local.request = None
+            self.release()
+            self._finish(request_memory)
+
+    def release(self):
+        """Drop unreachable objects and cached CUDA blocks so RSS does not creep up"""
+        if self.gc_after_request:
+            gc.collect()
+        if self.track_cuda:
+            import torch
+            torch.cuda.empty_cache()
+
+    def _finish(self, request_memory):
+        summary = request_memory.summary()
+        rss = current_rss_bytes()
+        with self._lock:
+            self.in_flight -= 1
+            self.requests_served += 1
+            self.peak_rss = max(self.peak_rss, request_memory.peak_rss, rss)
+            for name, stage in summary['stages'].items():
+                self.stage_peaks[name] = max(self.stage_peaks.get(name, 0), stage['peak_rss_mb'])
+            self.history.append(summary)
+
+            if not self.draining:
+                if self.max_requests and self.requests_served >= self.max_requests:
+                    self.draining = True
+                    self.drain_reason = f"served {self.requests_served} requests"
+                elif self.max_rss_bytes and rss >= self.max_rss_bytes:
+                    self.draining = True
+                    self.drain_reason = f"RSS {rss / MB:.0f}MB over {self.max_rss_bytes / MB:.0f}MB"
+                if self.draining:
+                    logger.warning(f"Worker draining: {self.drain_reason}")
+
+            recycle = self.draining and self.in_flight == 0 and not self._recycle_scheduled
+            if recycle:
+                self._recycle_scheduled = True
+
+        logger.info(f"Request memory: peak RSS {summary['peak_rss_mb']}MB, growth {summary['rss_growth_mb']}MB, "
+                    f"CUDA peak {summary['cuda_peak_mb']}MB")
+        if recycle:
+            self._schedule_recycle()
+
+    def _schedule_recycle(self):
+        # Give the last response time to be written before the process goes away;
+        # the container restart policy brings up a fresh worker.
+        logger.warning(f"Recycling worker in {self.recycle_grace_seconds}s")
+        timer = threading.Timer(self.recycle_grace_seconds, os.kill, args=(os.getpid(), signal.SIGTERM))
+        timer.daemon = True
+        timer.start()
+
+    # CUDA peaks of stages that ran alone
+
+    def _enter_cuda_window(self):
+        """
+        Start measuring the CUDA peak of a stage.
+
+        The peak counter is only reset when no other stage is running, so
+        overlapping stages never wipe each other's measurements.
+        """
+        import torch
+        with self._lock:
+            exclusive = self._cuda_stages == 0
+            if exclusive:
+                torch.cuda.reset_peak_memory_stats()
+            self._cuda_stages += 1
+            self._cuda_windows_opened += 1
+            return exclusive, self._cuda_windows_opened
+
+    def _exit_cuda_window(self, cuda_window):
+        """CUDA peak of the stage in bytes, or None when another stage ran alongside it"""
+        import torch
+        exclusive, opened = cuda_window
+        with self._lock:
+            self._cuda_stages -= 1
+            if exclusive and opened == self._cuda_windows_opened:
+                return torch.cuda.max_memory_allocated()
+            return None
+
+    # RSS sampling while stages are running
+
+    def _add_window(self, window):
+        with self._lock:
+            self._windows.add(window)
+
+    def _remove_window(self, window):
+        with self._lock:
+            self._windows.discard(window)
+
+    def _ensure_sampler(self):
+        with self._lock:
+            if self._sampler is not None and self._sampler.is_alive():
+                return
+            self._sampler = threading.Thread(target=self._sample_loop, name='memory-sampler', daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.sample_interval)
+            with self._lock:
+                if not self._windows:
+                    if self.in_flight == 0:
+                        self._sampler = None
+                        return
+                    continue
+                windows = list(self._windows)
+            rss = current_rss_bytes()
+            for window in windows:
+                if rss > window.peak_rss:
+                    window.peak_rss = rss
+
+    def snapshot(self):
+        """Numbers reported through /api/device-info"""
+        rss = current_rss_bytes()
+        with self._lock:
+            return {
+                'rss_mb': round(rss / MB, 1),
+                'peak_rss_mb': round(max(self.peak_rss, rss) / MB, 1),
+                'budget_mb': round(self.budget_bytes / MB, 1) if self.budget_bytes else None,
+                'oversize_policy': self.oversize_policy,
+                'in_flight': self.in_flight,
+                'requests_served': self.requests_served,
+                'requests_rejected': self.requests_rejected,
+                'images_downscaled': self.images_downscaled,
+                'max_requests': self.max_requests,
+                'max_rss_mb': round(self.max_rss_bytes / MB, 1) if self.max_rss_bytes else None,
+                'draining': self.draining,
+                'drain_reason': self.drain_reason,
+                'stage_peak_rss_mb': dict(self.stage_peaks),
+                'recent_requests': list(self.history)
+            }
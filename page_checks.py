@@ -0,0 +1,179 @@
+"""
+Cheap page checks that run before the OCR models.
+
+check_blank() classifies a page from pixel statistics of a small grayscale
+thumbnail: the background level is the most common gray value, and a page
+is blank when almost no pixels differ from it by more than the ink
+contrast. Scanner separator sheets, empty back sides and light bleed-through
+are caught without running detection or recognition.
+
+check_rotation() makes a page upright before recognition: a few of its
+detected lines are read as they are, and only when that reading is
+unconfident are they also read turned by 90, 180 and 270 degrees, keeping
+the turn that reads with clearly higher confidence. map_line_back() maps lines
+found on the upright page back onto the uploaded image.
+"""
+import logging
+from PIL import Image, ImageStat
+
+logger = logging.getLogger(__name__)
+
+# Modes Image.reduce() handles directly; anything else is converted to grayscale first
+REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'I', 'F')
+
+
+def grayscale_thumbnail(image, thumb_side=1024):
+    """Box-reduce an image so its longest side is about thumb_side and convert it to grayscale"""
+    if image.mode not in REDUCIBLE_MODES:
+        image = image.convert('L')
+    factor = max(1, max(image.size) // thumb_side)
+    thumb = image.reduce(factor) if factor > 1 else image
+    return thumb.convert('L') if thumb.mode != 'L' else thumb
+
+
+def check_blank(image, thumb_side=1024, contrast=64, max_ink_ratio=0.0001):
+    """
+    Decide whether a page has no content worth recognizing.
+
+    Returns (blank, stats) where stats holds the background level, the share
+    of ink pixels and the thumbnail size the decision was made on.
+    """
+    thumb = grayscale_thumbnail(image, thumb_side)
+    histogram = thumb.histogram()
+    total = sum(histogram) or 1
+    background = max(range(256), key=histogram.__getitem__)
+    # Dark text on light paper and light text on dark scans both count as ink
+    ink = sum(count for level, count in enumerate(histogram) if abs(level - background) > contrast)
+    ink_ratio = ink / total
+
+    stats = {
+        'blank': ink_ratio <= max_ink_ratio,
+        'background': background,
+        'ink_ratio': round(ink_ratio, 6),
+        'stddev': round(ImageStat.Stat(thumb).stddev[0], 2),
+        'thumb_size': list(thumb.size)
+    }
+    return stats['blank'], stats
+
+
+# EXIF orientation tag values and the transpose that makes the image upright
+EXIF_ORIENTATION = 0x0112
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90
+}
+
+
+def exif_transpose_method(image):
+    """Transpose that makes an image upright according to its EXIF orientation tag, or None"""
+    try:
+        orientation = image.getexif().get(EXIF_ORIENTATION)
+    except Exception:
+        return None
+    return EXIF_TRANSPOSE.get(orientation)
+
+
+# Turns tried on the sampled lines, in degrees counter-clockwise, and the transpose for each
+ROTATIONS = {
+    0: None,
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270
+}
+
+
+def _mean_confidence(confidences):
+    read = [c for c in confidences if c is not None]
+    return sum(read) / len(read) if read else None
+
+
+def check_rotation(image, bboxes, recognize, sample=3, margin=0.05, min_confidence=0.75):
+    """
+    Decide by how many degrees a page has to be turned to be upright.
+
+    The longest detected lines are read with recognize(crops) -> (texts,
+    confidences). A page whose lines read with a mean confidence of at least
+    min_confidence is taken as upright. Otherwise the lines are read again
+    turned by 90, 180 and 270 degrees in one more call; lines of a sideways
+    page are detected as tall boxes, so they only read well once turned by 90
+    or 270 degrees. The best turn wins when it reads clearly better than the
+    page as it is. Returns (rotation, stats); rotation is 0, 90, 180 or 270
+    degrees counter-clockwise.
+    """
+    longest = sorted(bboxes, key=lambda bbox: max(bbox[2] - bbox[0], bbox[3] - bbox[1]), reverse=True)[:sample]
+    crops = [image.crop(tuple(int(round(coord)) for coord in bbox)) for bbox in longest]
+    crops = [crop for crop in crops if crop.size[0] > 1 and crop.size[1] > 1]
+    if not crops:
+        return 0, {'sampled': 0}
+
+    mean_confidence = {}
+    stats = {'sampled': len(crops), 'confidence': {}}
+    upright = _mean_confidence(recognize(crops)[1])
+    if upright is None:
+        return 0, stats
+    mean_confidence[0] = upright
+    stats['confidence']['0'] = round(upright, 4)
+    if upright >= min_confidence:
+        return 0, stats
+
+    turns = [rotation for rotation in ROTATIONS if rotation]
+    _, confidences = recognize([crop.transpose(ROTATIONS[rotation]) for rotation in turns for crop in crops])
+    for index, rotation in enumerate(turns):
+        confidence = _mean_confidence(confidences[index * len(crops):(index + 1) * len(crops)])
+        if confidence is not None:
+            mean_confidence[rotation] = confidence
+            stats['confidence'][str(rotation)] = round(confidence, 4)
+
+    best = max(mean_confidence, key=mean_confidence.get)
+    if best != 0 and mean_confidence[best] > mean_confidence[0] + margin:
+        return best, stats
+    return 0, stats
+
+
+def _point_before(x, y, method, size):
+    """Map a point of a transposed image back onto the image of the given size it was made from"""
+    width, height = size
+    if method == Image.Transpose.FLIP_LEFT_RIGHT:
+        return width - x, y
+    if method == Image.Transpose.FLIP_TOP_BOTTOM:
+        return x, height - y
+    if method == Image.Transpose.ROTATE_90:
+        return width - y, x
+    if method == Image.Transpose.ROTATE_180:
+        return width - x, height - y
+    if method == Image.Transpose.ROTATE_270:
+        return y, height - x
+    if method == Image.Transpose.TRANSPOSE:
+        return y, x
+    if method == Image.Transpose.TRANSVERSE:
+        return width - y, height - x
+    return x, y
+
+
+def map_line_back(line_data, transforms):
+    """
+    Map a text line found on the upright image back to the image before orientation fixes.
+
+    transforms lists (method, size) in the order the transposes were applied,
+    size being that of the image each one was applied to. Works in place.
+    """
+    if not transforms:
+        return line_data
+
+    def point_before(x, y):
+        for method, size in reversed(transforms):
+            x, y = _point_before(x, y, method, size)
+        return x, y
+
+    x1, y1, x2, y2 = line_data['bbox']
+    corners = [point_before(x, y) for x, y in ((x1, y1), (x2, y1), (x2, y2), (x1, y2))]
+    line_data['bbox'] = [min(x for x, _ in corners), min(y for _, y in corners),
+                         max(x for x, _ in corners), max(y for _, y in corners)]
+    if line_data.get('polygon'):
+        line_data['polygon'] = [list(point_before(x, y)) for x, y in line_data['polygon']]
+    return line_data
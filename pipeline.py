@@ -0,0 +1,158 @@
+"""
+Stage-pipelined execution of OCR jobs.
+
+Each stage (decode, detect, recognize, render) runs on its own worker
+thread(s) and hands jobs to the next stage through a bounded queue, so
+detection of image N+1 overlaps recognition of image N and rendering of
+image N-1. The bounded queues give backpressure: when a stage falls behind,
+the stages in front of it block instead of piling decoded images up in
+memory. Per-stage busy time shows which stage is the bottleneck.
+"""
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class PipelineStage:
+    """One stage: a function applied to each job by a fixed number of worker threads"""
+
+    def __init__(self, name, func, workers=1, queue_size=2):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.inbox = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.threads = []
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        # Time spent waiting for room in the next stage's queue (backpressure)
+        self.blocked_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def stats(self, uptime):
+        with self._lock:
+            capacity = uptime * self.workers
+            return {
+                'workers': self.workers,
+                'active': self.active,
+                'queued': self.inbox.qsize(),
+                'processed': self.processed,
+                'failed': self.failed,
+                'busy_seconds': round(self.busy_seconds, 3),
+                'blocked_seconds': round(self.blocked_seconds, 3),
+                'utilization': round(self.busy_seconds / capacity, 4) if capacity > 0 else 0.0
+            }
+
+
+class StagePipeline:
+    """
+    Chain of stages connected by bounded queues.
+
+    Every stage function receives the job object and may update it; the
+    return value of the last stage becomes the job's result. context(job),
+    when given, returns a context manager entered around every stage call,
+    e.g. to attribute memory to the request that submitted the job.
+    """
+
+    def __init__(self, stages, queue_size=2, context=None):
+        self.stages = [PipelineStage(name, func, workers, queue_size) for name, func, workers in stages]
+        self.context = context or (lambda job: nullcontext())
+        self.started_at = None
+        self.submitted = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.started_at is not None:
+                return
+            self.started_at = time.monotonic()
+            for index, stage in enumerate(self.stages):
+                for worker in range(stage.workers):
+                    thread = threading.Thread(target=self._work, args=(index,),
+                                              name=f"ocr-{stage.name}-{worker}", daemon=True)
+                    thread.start()
+                    stage.threads.append(thread)
+        logger.info("Started OCR pipeline: " + ", ".join(f"{s.name} x{s.workers}" for s in self.stages))
+
+    def submit(self, job):
+        """Queue a job and return a Future for its result; blocks while the first stage is full"""
+        self.start()
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self._lock:
+            self.submitted += 1
+        self.stages[0].inbox.put((job, future))
+        return future
+
+    def run(self, job):
+        return self.submit(job).result()
+
+    def _work(self, index):
+        stage = self.stages[index]
+        outbox = self.stages[index + 1].inbox if index + 1 < len(self.stages) else None
+        while True:
+            item = stage.inbox.get()
+            if item is _STOP:
+                return
+            job, future = item
+
+            with stage._lock:
+                stage.active += 1
+            started = time.monotonic()
+            try:
+                with self.context(job):
+                    result = stage.func(job)
+            except BaseException as e:
+                with stage._lock:
+                    stage.failed += 1
+                future.set_exception(e)
+                continue
+            finally:
+                with stage._lock:
+                    stage.active -= 1
+                    stage.busy_seconds += time.monotonic() - started
+
+            with stage._lock:
+                stage.processed += 1
+            if outbox is None:
+                future.set_result(result)
+                continue
+
+            blocked_at = time.monotonic()
+            outbox.put((job, future))
+            with stage._lock:
+                stage.blocked_seconds += time.monotonic() - blocked_at
+
+    def stats(self):
+        uptime = time.monotonic() - self.started_at if self.started_at is not None else 0.0
+        stages = {stage.name: stage.stats(uptime) for stage in self.stages}
+        completed = stages[self.stages[-1].name]['processed'] if self.stages else 0
+        failed = sum(stage['failed'] for stage in stages.values())
+        busiest = max(stages, key=lambda name: stages[name]['utilization']) if uptime > 0 else None
+        return {
+            'uptime_seconds': round(uptime, 3),
+            'submitted': self.submitted,
+            'completed': completed,
+            'failed': failed,
+            'in_flight': self.submitted - completed - failed,
+            'bottleneck': busiest,
+            'stages': stages
+        }
+
+    def close(self):
+        """Finish the queued jobs and stop the workers, one stage after the other"""
+        if self.started_at is None:
+            return
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.inbox.put(_STOP)
+            for thread in stage.threads:
+                thread.join()
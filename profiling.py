@@ -0,0 +1,151 @@
+"""
+On-demand profiling for the OCR service.
+
+Nothing here runs unless an admin asks for it: per-request profiles wrap a
+single call in cProfile or the torch profiler, and the sampling profiler only
+spins up a thread for the duration of a capture. The sampler writes folded
+stacks ("frame;frame;frame count" lines) that flamegraph.pl, speedscope and
+inferno read directly.
+"""
+import os
+import sys
+import hmac
+import time
+import pstats
+import cProfile
+import threading
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Only one sampling capture at a time; overlapping captures would skew each other
+_sampling_lock = threading.Lock()
+
+
+def admin_token():
+    """Token that unlocks profiling; profiling is disabled when it is not configured"""
+    return os.environ.get('OCR_ADMIN_TOKEN', '')
+
+
+def is_admin(provided_token):
+    """Check a token supplied by the caller against OCR_ADMIN_TOKEN"""
+    expected = admin_token()
+    if not expected or not provided_token:
+        return False
+    return hmac.compare_digest(expected.encode(), provided_token.encode())
+
+
+def _cprofile_summary(profiler, limit):
+    stats = pstats.Stats(profiler)
+    stats.sort_stats('cumulative')
+    rows = []
+    for func in stats.fcn_list[:limit]:
+        primitive_calls, total_calls, total_time, cumulative_time, _ = stats.stats[func]
+        filename, line, name = func
+        rows.append({
+            'function': f"{os.path.basename(filename)}:{line}({name})",
+            'calls': total_calls,
+            'primitive_calls': primitive_calls,
+            'total_time': round(total_time, 4),
+            'cumulative_time': round(cumulative_time, 4)
+        })
+    return {
+        'profiler': 'cprofile',
+        'total_calls': stats.total_calls,
+        'total_time': round(stats.total_tt, 4),
+        'top_functions': rows
+    }
+
+
+def _torch_summary(profiler, limit):
+    events = profiler.key_averages()
+    sort_key = 'self_cuda_time_total' if any(getattr(e, 'self_cuda_time_total', 0) for e in events) else 'self_cpu_time_total'
+    rows = []
+    for event in sorted(events, key=lambda e: getattr(e, sort_key, 0), reverse=True)[:limit]:
+        rows.append({
+            'operator': event.key,
+            'calls': event.count,
+            'self_cpu_ms': round(event.self_cpu_time_total / 1000, 3),
+            'cpu_total_ms': round(event.cpu_time_total / 1000, 3),
+            'self_cuda_ms': round(getattr(event, 'self_cuda_time_total', 0) / 1000, 3)
+        })
+    return {
+        'profiler': 'torch',
+        'sorted_by': sort_key,
+        'top_operators': rows
+    }
+
+
+def profile_call(mode, func, *args, limit=30, **kwargs):
+    """
+    Run func under the requested profiler.
+
+    mode is 'cprofile' or 'torch'. Returns (result, summary) where summary is
+    a JSON-serializable dict of the hottest functions or operators.
+    """
+    start = time.time()
+    if mode == 'torch':
+        import torch
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        with torch.profiler.profile(activities=activities, record_shapes=False) as profiler:
+            result = func(*args, **kwargs)
+        summary = _torch_summary(profiler, limit)
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profiler.disable()
+        summary = _cprofile_summary(profiler, limit)
+
+    summary['wall_time'] = round(time.time() - start, 4)
+    return result, summary
+
+
+def _frame_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return ';'.join(stack)
+
+
+def sample_stacks(seconds, interval=0.01):
+    """
+    Sample the stacks of every thread for the given duration.
+
+    Returns (folded_stacks, sample_count). Raises RuntimeError when another
+    capture is already running.
+    """
+    if not _sampling_lock.acquire(blocking=False):
+        raise RuntimeError("A sampling capture is already running")
+
+    try:
+        own_thread = threading.get_ident()
+        thread_names = {}
+        counts = Counter()
+        samples = 0
+        deadline = time.time() + seconds
+        logger.info(f"Sampling all thread stacks for {seconds}s every {interval * 1000:.0f}ms")
+
+        while time.time() < deadline:
+            for thread in threading.enumerate():
+                thread_names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                thread_name = thread_names.get(thread_id, str(thread_id))
+                counts[f"{thread_name};{_frame_stack(frame)}"] += 1
+            samples += 1
+            time.sleep(interval)
+    finally:
+        _sampling_lock.release()
+
+    folded = '\n'.join(f"{stack} {count}" for stack, count in counts.most_common())
+    return folded + '\n', samples
@@ -0,0 +1,216 @@
+"""
+Batch-size bucketing for the (optionally torch.compile'd) recognition model.
+
+The number of line crops varies per request, which makes the compiled decoder
+recompile and grow its graph cache. Every recognition call is padded with
+blank crops up to the nearest batch-size bucket, so the model only ever sees
+a fixed set of batch shapes. Crop widths need no bucketing: the recognition
+processor scales every crop to fit its fixed input size and pads it there.
+The buckets can be pre-warmed at startup, and counters report recompilations
+and padding waste.
+"""
+import os
+import bisect
+import threading
+import logging
+from collections import Counter
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_BUCKETS = '1,4,16,64,256'
+
+
+def _parse_buckets(value):
+    return sorted({int(item) for item in value.split(',') if item.strip()})
+
+
+def dynamo_counters():
+    """Graph and recompile counts reported by TorchDynamo, if it is in use"""
+    try:
+        from torch._dynamo.utils import counters
+    except Exception:
+        return {'unique_graphs': 0, 'recompiles': 0}
+    return {
+        'unique_graphs': int(counters['stats'].get('unique_graphs', 0)),
+        'recompiles': int(sum(counters['recompiles'].values())) if 'recompiles' in counters else 0
+    }
+
+
+class RecognitionBucketer:
+    """Pads recognition calls to a fixed set of batch sizes"""
+
+    def __init__(self, batch_buckets):
+        self.batch_buckets = batch_buckets
+        self._lock = threading.Lock()
+        self._baseline = dynamo_counters()
+        self.calls = 0
+        self.lines = 0
+        self.padded_lines = 0
+        self.bucket_usage = Counter()
+        self.prewarmed = []
+
+    @classmethod
+    def from_env(cls, max_batch_size=None):
+        """Build from RECOGNITION_BATCH_BUCKETS, capped at the model batch size"""
+        batch_buckets = _parse_buckets(os.environ.get('RECOGNITION_BATCH_BUCKETS', DEFAULT_BATCH_BUCKETS))
+        if max_batch_size:
+            batch_buckets = [size for size in batch_buckets if size < max_batch_size] + [int(max_batch_size)]
+        return cls(batch_buckets)
+
+    def batch_bucket(self, count):
+        index = bisect.bisect_left(self.batch_buckets, count)
+        return self.batch_buckets[index] if index < len(self.batch_buckets) else self.batch_buckets[-1]
+
+    def plan(self, crops):
+        """
+        Group crop indices into recognition calls.
+
+        Returns a list of (batch_bucket, indices) tuples; each call holds at
+        most batch_bucket crops, in input order.
+        """
+        max_batch = self.batch_buckets[-1]
+        calls = []
+        for start in range(0, len(crops), max_batch):
+            chunk = list(range(start, min(start + max_batch, len(crops))))
+            calls.append((self.batch_bucket(len(chunk)), chunk))
+        return calls
+
+    def recognize(self, crops, lang_list, rec_model, rec_processor):
+        """Recognize line crops in bucketed batches; returns (texts, confidences) in input order"""
+        from surya.recognition import batch_recognition
+
+        texts = [''] * len(crops)
+        confidences = [None] * len(crops)
+        for batch_size, indices in self.plan(crops):
+            batch = [crops[i] for i in indices]
+            padding = batch_size - len(batch)
+            if padding > 0:
+                batch.extend([Image.new('RGB', (32, 32), (255, 255, 255))] * padding)
+
+            result = batch_recognition(batch, [lang_list] * len(batch), rec_model, rec_processor, batch_size=batch_size)
+            if isinstance(result, tuple) and len(result) == 2:
+                batch_texts, batch_confidences = result
+            else:
+                batch_texts, batch_confidences = result, [None] * len(batch)
+
+            for position, index in enumerate(indices):
+                texts[index] = batch_texts[position]
+                confidences[index] = batch_confidences[position]
+
+            self._record(batch_size, len(indices), padding)
+        return texts, confidences
+
+    def _record(self, batch_size, lines, padding):
+        with self._lock:
+            self.calls += 1
+            self.lines += lines
+            self.padded_lines += max(0, padding)
+            self.bucket_usage[f"b{batch_size}"] += 1
+
+    def prewarm(self, rec_model, rec_processor, lang_list=('en',)):
+        """Run one blank batch per batch bucket so compilation happens at startup"""
+        from surya.recognition import batch_recognition
+
+        blank = Image.new('RGB', (256, 32), (255, 255, 255))
+        for batch_size in self.batch_buckets:
+            logger.info(f"Pre-warming recognition bucket: batch {batch_size}")
+            batch_recognition([blank] * batch_size, [list(lang_list)] * batch_size, rec_model, rec_processor,
+                              batch_size=batch_size)
+            self.prewarmed.append(batch_size)
+        # Compiles during warm-up are expected; only count the ones that happen while serving
+        self._baseline = dynamo_counters()
+
+    def stats(self):
+        counters = dynamo_counters()
+        with self._lock:
+            total_lines = self.lines + self.padded_lines
+            return {
+                'batch_buckets': self.batch_buckets,
+                'prewarmed_batches': list(self.prewarmed),
+                'calls': self.calls,
+                'lines': self.lines,
+                'padded_lines': self.padded_lines,
+                # Share of recognized crops that were blank batch padding
+                'padding_waste': round(self.padded_lines / total_lines, 4) if total_lines else 0.0,
+                'bucket_usage': dict(self.bucket_usage),
+                'unique_graphs': counters['unique_graphs'],
+                'recompiles_since_warmup': counters['recompiles'] - self._baseline['recompiles'],
+                'graphs_since_warmup': counters['unique_graphs'] - self._baseline['unique_graphs']
+            }
+
+
+def detect_text(images, det_model, det_processor):
+    """Detection half of run_bucketed_ocr; returns surya's per-image detection results"""
+    from surya.detection import batch_text_detection
+
+    return batch_text_detection(images, det_model, det_processor)
+
+
+def recognize_detected(images, det_predictions, langs, rec_model, rec_processor, bucketer=None):
+    """
+    Recognition half of run_bucketed_ocr for images that were already detected.
+
+    Without a bucketer the line crops go straight to surya's batch_recognition.
+    As in surya's run_ocr, lines become TextLines sorted into reading order.
+    Returns, per image, a list of text line dicts.
+    """
+    from surya.input.processing import slice_polys_from_image
+    from surya.postprocessing.text import sort_text_lines
+    from surya.schema import TextLine
+
+    all_crops, all_langs, owners = [], [], []
+    for image_index, (image, prediction, lang_list) in enumerate(zip(images, det_predictions, langs)):
+        polygons = [box.polygon for box in prediction.bboxes]
+        crops = slice_polys_from_image(image, polygons) if polygons else []
+        for line_index, crop in enumerate(crops):
+            all_crops.append(crop)
+            owners.append((image_index, line_index))
+        all_langs.append(lang_list)
+
+    lines_by_image = [[] for _ in images]
+    # Images that share a language list have their lines recognized in one call
+    groups = {}
+    for position, (image_index, _) in enumerate(owners):
+        groups.setdefault(tuple(all_langs[image_index]), []).append(position)
+    for lang_key, positions in groups.items():
+        lang_list = list(lang_key)
+        crops = [all_crops[i] for i in positions]
+        if bucketer is not None:
+            texts, confidences = bucketer.recognize(crops, lang_list, rec_model, rec_processor)
+        else:
+            from surya.recognition import batch_recognition
+            result = batch_recognition(crops, [lang_list] * len(crops), rec_model, rec_processor)
+            if isinstance(result, tuple) and len(result) == 2:
+                texts, confidences = result
+            else:
+                texts, confidences = result, [None] * len(crops)
+        for position, text, confidence in zip(positions, texts, confidences):
+            image_index, line_index = owners[position]
+            box = det_predictions[image_index].bboxes[line_index]
+            lines_by_image[image_index].append(TextLine(
+                text=text, polygon=box.polygon, confidence=float(confidence) if confidence is not None else None))
+    return [[text_line_dict(line) for line in sort_text_lines(lines)] for lines in lines_by_image]
+
+
+def text_line_dict(line):
+    """JSON-friendly form of a surya TextLine"""
+    return {
+        'text': line.text,
+        'bbox': line.bbox,
+        'polygon': line.polygon if hasattr(line, 'polygon') else None,
+        'confidence': float(line.confidence) if getattr(line, 'confidence', None) is not None else None,
+        'vertical': line.vertical if hasattr(line, 'vertical') else False
+    }
+
+
+def run_bucketed_ocr(images, langs, det_model, det_processor, rec_model, rec_processor, bucketer):
+    """
+    Equivalent of surya's run_ocr with recognition routed through the bucketer.
+
+    Returns, per image, a list of text line dicts (text, bbox, polygon,
+    confidence, vertical).
+    """
+    det_predictions = detect_text(images, det_model, det_processor)
+    return recognize_detected(images, det_predictions, langs, rec_model, rec_processor, bucketer)
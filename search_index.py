@@ -0,0 +1,189 @@
+"""
+Full-text index over processed OCR results.
+
+Every processed document's text lines (text, bbox, confidence, page) are stored
+in a local SQLite database with an FTS5 table over the line text, so finding
+which document contained a string is a query instead of another OCR run.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    doc_id TEXT NOT NULL UNIQUE,
+    filename TEXT,
+    pdf_url TEXT,
+    langs TEXT,
+    tenant TEXT,
+    line_count INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    page INTEGER NOT NULL,
+    line_no INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    bbox TEXT,
+    confidence REAL
+);
+CREATE INDEX IF NOT EXISTS lines_document ON lines(document_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(
+    text,
+    content='lines',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS lines_ai AFTER INSERT ON lines BEGIN
+    INSERT INTO lines_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS lines_ad AFTER DELETE ON lines BEGIN
+    INSERT INTO lines_fts(lines_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+
+def build_match_query(query):
+    """
+    Turn free text into an FTS5 MATCH expression.
+
+    Every whitespace-separated term is quoted so punctuation in receipts
+    (prices, dates, dashes) is matched literally; a trailing '*' on a term
+    keeps prefix matching. All terms must appear in the same line.
+    """
+    terms = []
+    for term in query.split():
+        prefix = term.endswith('*')
+        term = term.rstrip('*').replace('"', '""')
+        if not term:
+            continue
+        terms.append(f'"{term}"*' if prefix else f'"{term}"')
+    return ' '.join(terms)
+
+
+class SearchIndex:
+    """SQLite FTS5 index of OCR text lines, safe to share between request threads"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA foreign_keys=ON')
+            self._conn.executescript(SCHEMA)
+            # Indexes created before documents were scoped to tenants lack the column
+            columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(documents)')}
+            if 'tenant' not in columns:
+                self._conn.execute('ALTER TABLE documents ADD COLUMN tenant TEXT')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS documents_tenant ON documents(tenant)')
+        logger.info(f"Search index opened at {path}")
+
+    def add_document(self, doc_id, text_lines, filename=None, pdf_url=None, langs=None, page=1, tenant=None):
+        """Index the text lines of one processed document, replacing any previous version; tenant owns it"""
+        rows = []
+        for line_no, line in enumerate(text_lines):
+            if not line.get('text'):
+                continue
+            rows.append((
+                line.get('page', page),
+                line_no,
+                line['text'],
+                json.dumps([float(coord) for coord in line['bbox']]) if line.get('bbox') is not None else None,
+                line.get('confidence')
+            ))
+
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM lines WHERE document_id IN (SELECT id FROM documents WHERE doc_id = ?)', (doc_id,))
+            self._conn.execute('DELETE FROM documents WHERE doc_id = ?', (doc_id,))
+            cursor = self._conn.execute(
+                'INSERT INTO documents (doc_id, filename, pdf_url, langs, tenant, line_count, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (doc_id, filename, pdf_url, langs, tenant, len(rows), time.time())
+            )
+            document_id = cursor.lastrowid
+            self._conn.executemany(
+                'INSERT INTO lines (document_id, page, line_no, text, bbox, confidence) VALUES (?, ?, ?, ?, ?, ?)',
+                [(document_id,) + row for row in rows]
+            )
+        return len(rows)
+
+    def search(self, query, limit=20, lines_per_document=10, tenant=None, all_tenants=False):
+        """
+        Return documents matching the query, best first, each with the
+        coordinates of its matching lines.
+
+        Only documents owned by tenant are searched unless all_tenants is set.
+        """
+        match = build_match_query(query)
+        if not match:
+            return []
+
+        tenant_filter, params = '', (match,)
+        if not all_tenants:
+            tenant_filter, params = 'AND d.tenant = ?', (match, tenant)
+
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT d.doc_id, d.filename, d.pdf_url, d.langs, d.created_at,
+                       l.page, l.line_no, l.text, l.bbox, l.confidence,
+                       highlight(lines_fts, 0, '[', ']') AS highlighted,
+                       bm25(lines_fts) AS score
+                FROM lines_fts
+                JOIN lines l ON l.id = lines_fts.rowid
+                JOIN documents d ON d.id = l.document_id
+                WHERE lines_fts MATCH ? {tenant_filter}
+                ORDER BY score
+                LIMIT ?
+                """.format(tenant_filter=tenant_filter),
+                params + (limit * lines_per_document,)
+            ).fetchall()
+
+        documents = {}
+        for row in rows:
+            document = documents.get(row['doc_id'])
+            if document is None:
+                if len(documents) >= limit:
+                    continue
+                document = documents[row['doc_id']] = {
+                    'document_id': row['doc_id'],
+                    'filename': row['filename'],
+                    'pdfUrl': row['pdf_url'],
+                    'langs': row['langs'],
+                    'created_at': row['created_at'],
+                    # bm25 is lower-is-better; report the best line's score flipped to higher-is-better
+                    'score': round(-row['score'], 4),
+                    'matches': []
+                }
+            if len(document['matches']) < lines_per_document:
+                document['matches'].append({
+                    'text': row['text'],
+                    'highlighted': row['highlighted'],
+                    'bbox': json.loads(row['bbox']) if row['bbox'] else None,
+                    'confidence': row['confidence'],
+                    'page': row['page'],
+                    'line': row['line_no']
+                })
+        return list(documents.values())
+
+    def stats(self):
+        with self._lock:
+            documents = self._conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+            lines = self._conn.execute('SELECT COUNT(*) FROM lines').fetchone()[0]
+        return {'documents': documents, 'lines': lines, 'path': self.path}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
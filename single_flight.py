@@ -0,0 +1,127 @@
+"""
+In-flight deduplication of identical OCR requests.
+
+Clients that retry aggressively send the same image several times within a
+second. The first request for a key leads and runs the computation; requests
+for the same key that arrive while it is running follow: they wait for the
+leader and receive its result (or its error) instead of running OCR again.
+Nothing is kept once the leader finishes, so this is not a result cache.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(path, *parts):
+    """Key from a file's content and any further request options that change the result"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    for part in parts:
+        digest.update(b'\0' + repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.future = Future()
+        self.followers = 0
+        # Leader's run under do_async(); kept here so the detached task is not garbage collected
+        self.task = None
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time and shares its outcome with concurrent callers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.max_followers = 0
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.coalesced += 1
+                self.max_followers = max(self.max_followers, flight.followers)
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.leaders += 1
+            return flight, True
+
+    def _land(self, key, flight, result=None, error=None):
+        with self._lock:
+            del self._flights[key]
+            if error is not None:
+                self.failed += 1
+        if flight.followers:
+            logger.info(f"Shared result of {key[:12]} with {flight.followers} coalesced request(s)")
+        if error is not None:
+            flight.future.set_exception(error)
+        else:
+            flight.future.set_result(result)
+
+    def do(self, key, func):
+        """Return (result, shared); func() runs only if no call for key is in flight. A None key is never shared"""
+        if key is None:
+            return func(), False
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.future.result(), True
+        try:
+            result = func()
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, result=result)
+        return result, False
+
+    async def do_async(self, key, func):
+        """
+        Coroutine version of do(); func is an async callable and followers wait without blocking the loop.
+
+        The leader's func() runs as a task of its own that the leader awaits
+        like its followers, so a leader that is cancelled (its client went
+        away) leaves the run going for the followers, typically that client's
+        own retry.
+        """
+        if key is None:
+            return await func(), False
+        flight, leader = self._join(key)
+        if leader:
+            flight.task = asyncio.ensure_future(self._run_async(key, flight, func()))
+        # A cancelled caller must not cancel the shared run
+        return await asyncio.shield(asyncio.wrap_future(flight.future)), not leader
+
+    async def _run_async(self, key, flight, coroutine):
+        try:
+            result = await coroutine
+        except asyncio.CancelledError:
+            # The run itself was cancelled (e.g. at shutdown): callers get an error, never the cancellation
+            self._land(key, flight, error=RuntimeError(f"Shared run of {key[:12]} was cancelled"))
+            raise
+        except BaseException as e:
+            self._land(key, flight, error=e)
+        else:
+            self._land(key, flight, result=result)
+
+    def stats(self):
+        with self._lock:
+            requests = self.leaders + self.coalesced
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'failed': self.failed,
+                'max_followers': self.max_followers,
+                'coalesced_ratio': round(self.coalesced / requests, 4) if requests else 0.0
+            }
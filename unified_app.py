@@ -6,10 +6,18 @@ import threading
 import logging
 from PIL import Image, ImageDraw
 import torch
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, Response
 import requests
 from werkzeug.utils import secure_filename
 import time
+from memory_governor import MemoryGovernor, MemoryBudgetExceeded, WorkerDraining
+import profiling
+from search_index import SearchIndex
+from recognition_buckets import RecognitionBucketer, detect_text, recognize_detected
+from admission import AdmissionController, AdmissionRejected
+import page_checks
+from pipeline import StagePipeline
+from single_flight import SingleFlight, content_key
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -36,7 +44,6 @@ else:
 logger.info(f"Using device: {device}")
 
 # Surya OCR import - import after setting device
-from surya.ocr import run_ocr
 from surya.model.detection.model import load_model as load_det_model, load_processor as load_det_processor
 from surya.model.recognition.model import load_model as load_rec_model
 from surya.model.recognition.processor import load_processor as load_rec_processor
@@ -66,6 +73,47 @@ PDF_FOLDER = 'pdf'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'tif', 'tiff', 'bmp'}
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload size
 
+# Two-tier OCR: a cheap pass on a downscaled image, then full-resolution
+# re-recognition of the lines whose confidence is below the threshold
+OCR_DEFAULT_MODE = os.environ.get("OCR_DEFAULT_MODE", "accurate").lower()
+OCR_FAST_SCALE = float(os.environ.get("OCR_FAST_SCALE", "0.5"))
+OCR_FAST_MIN_SIDE = int(os.environ.get("OCR_FAST_MIN_SIDE", "1200"))
+OCR_ESCALATION_CONFIDENCE = float(os.environ.get("OCR_ESCALATION_CONFIDENCE", "0.8"))
+
+# Full-text index of processed documents (kept outside PDF_FOLDER so it is never served)
+SEARCH_INDEX_ENABLED = os.environ.get("SEARCH_INDEX_ENABLED", "true").lower() == "true"
+SEARCH_INDEX_PATH = os.environ.get("SEARCH_INDEX_PATH", os.path.join('index', 'ocr_index.db'))
+
+# Pad recognition calls to fixed batch-size buckets so the compiled decoder stops recompiling;
+# auto (the default) buckets and RECOGNITION_PREWARM=auto warms them only when the decoder was compiled
+RECOGNITION_BUCKETING = os.environ.get("RECOGNITION_BUCKETING", "auto").lower()
+RECOGNITION_PREWARM = os.environ.get("RECOGNITION_PREWARM", "auto").lower()
+
+# Blank page fast path: pages whose thumbnail has almost no ink skip detection, recognition and PDF layout
+BLANK_PAGE_CHECK = os.environ.get("BLANK_PAGE_CHECK", "true").lower() == "true"
+BLANK_PAGE_MAX_INK = float(os.environ.get("BLANK_PAGE_MAX_INK", "0.0001"))
+BLANK_PAGE_CONTRAST = int(os.environ.get("BLANK_PAGE_CONTRAST", "64"))
+
+# Orientation: pages without an EXIF turn whose sampled lines read below ORIENTATION_MIN_CONFIDENCE are
+# tried turned by 90, 180 and 270 degrees, and turned before recognition when one reads clearly better
+ORIENTATION_CHECK = os.environ.get("ORIENTATION_CHECK", "true").lower() == "true"
+ORIENTATION_SAMPLE_LINES = int(os.environ.get("ORIENTATION_SAMPLE_LINES", "3"))
+ORIENTATION_FLIP_MARGIN = float(os.environ.get("ORIENTATION_FLIP_MARGIN", "0.05"))
+ORIENTATION_MIN_CONFIDENCE = float(os.environ.get("ORIENTATION_MIN_CONFIDENCE", "0.75"))
+
+# Run decode, detection, recognition and rendering as pipelined stages on their own threads,
+# so concurrent requests and batches overlap instead of running each image strictly in sequence
+OCR_PIPELINE = os.environ.get("OCR_PIPELINE", "true").lower() == "true"
+OCR_PIPELINE_QUEUE_SIZE = int(os.environ.get("OCR_PIPELINE_QUEUE_SIZE", "2"))
+OCR_PIPELINE_DECODE_WORKERS = int(os.environ.get("OCR_PIPELINE_DECODE_WORKERS", "2"))
+OCR_PIPELINE_RENDER_WORKERS = int(os.environ.get("OCR_PIPELINE_RENDER_WORKERS", "2"))
+# Requests the pipeline can overlap: one per stage. Inference slots default to it, so concurrent
+# API requests actually share the pipeline instead of entering it one at a time
+OCR_PIPELINE_DEPTH = 4 if OCR_PIPELINE else 1
+
+# Concurrent uploads of the same image with the same options share one OCR run
+SINGLE_FLIGHT = os.environ.get("SINGLE_FLIGHT", "true").lower() == "true"
+
 # Create directories if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PDF_FOLDER, exist_ok=True)
@@ -82,10 +130,29 @@ det_processor = None
 det_model = None
 rec_processor = None
 rec_model = None
+recognition_bucketer = None
+ocr_pipeline = None
+
+# The models keep per-call state (recognition runs with a static KV cache), so each is used by one thread
+# at a time; the pipeline stages, request threads and the Gradio UI in app.py all go through these locks
+detection_lock = threading.RLock()
+recognition_lock = threading.RLock()
+
+# Per-request memory accounting, image admission and worker recycling
+memory_governor = MemoryGovernor.from_env()
+
+# Full-text search over every processed document's text lines
+search_index = SearchIndex(SEARCH_INDEX_PATH) if SEARCH_INDEX_ENABLED else None
+
+# Per-tenant rate limits, concurrency caps and fair queueing in front of inference
+admission_controller = AdmissionController.from_env(default_slots=OCR_PIPELINE_DEPTH)
+
+# In-flight deduplication of identical OCR requests
+ocr_flights = SingleFlight() if SINGLE_FLIGHT else None
 
 def load_ocr_models():
     """Load OCR models"""
-    global det_processor, det_model, rec_processor, rec_model
+    global det_processor, det_model, rec_processor, rec_model, recognition_bucketer, ocr_pipeline
     
     logger.info(f"Loading OCR models on {device}...")
     
@@ -106,18 +173,34 @@ def load_ocr_models():
         raise
     
     # No need to compile on GPU - the models are already on the right device
+    compiled = False
     if device == 'cuda':
         logger.info("GPU mode active, skipping model compilation")
     elif os.environ.get("SKIP_COMPILE", "").lower() != "true":
         logger.info("Compiling recognition model...")
         try:
             rec_model.decoder.model = torch.compile(rec_model.decoder.model)
+            compiled = True
             logger.info("Recognition model compilation completed successfully")
         except Exception as e:
             logger.error(f"Error during recognition model compilation: {e}")
             logger.warning("Continuing without model compilation")
     else:
         logger.info("Skipping model compilation as requested by environment variable")
+    
+    # An uncompiled decoder cannot recompile, so padding its calls would only waste work
+    if RECOGNITION_BUCKETING == 'true' or (RECOGNITION_BUCKETING == 'auto' and compiled):
+        recognition_bucketer = RecognitionBucketer.from_env(max_batch_size=int(os.environ["RECOGNITION_BATCH_SIZE"]))
+        logger.info(f"Recognition buckets: batch sizes {recognition_bucketer.batch_buckets}")
+        if RECOGNITION_PREWARM == 'true' or (RECOGNITION_PREWARM == 'auto' and compiled):
+            try:
+                recognition_bucketer.prewarm(rec_model, rec_processor)
+                logger.info("Recognition buckets pre-warmed successfully")
+            except Exception as e:
+                logger.error(f"Error pre-warming recognition buckets: {e}")
+    
+    if OCR_PIPELINE and ocr_pipeline is None:
+        ocr_pipeline = build_ocr_pipeline()
 
 class CustomJSONEncoder(json.JSONEncoder):
     """Custom JSON encoder to handle PIL Image and other objects"""
@@ -128,229 +211,541 @@ class CustomJSONEncoder(json.JSONEncoder):
             return {k: self.default(v) for k, v in obj.__dict__.items()}
         return str(obj)
 
-def process_ocr(image_path, langs):
-    """Process image with OCR and generate PDF"""
-    logger.info(f"Processing OCR for {image_path} with languages: {langs}")
+def render_blank_pdf(pdf_path):
+    """Write a single empty A4 page; zero-line results need no fonts or layout"""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
     
-    try:
-        # Open the image
-        image = Image.open(image_path)
-        logger.info(f"Image loaded: {image.size}")
-        
-        # Convert languages string to list
-        lang_list = langs.split(',')
-        
-        # Run OCR with GPU acceleration if available
-        start_time = time.time()
-        
-        # GPU kullanımı için modelleri doğru cihaza taşıyoruz, ama run_ocr'a device parametresi gönderemiyoruz
-        # O yüzden modeller zaten GPU'ya taşındıysa, GPU kullanılacaktır
-        predictions = run_ocr([image], [lang_list], det_model, det_processor, rec_model, rec_processor)
-        
-        ocr_time = time.time() - start_time
-        logger.info(f"OCR processing completed in {ocr_time:.2f} seconds on {device}")
-        
-        # Get extracted text
-        text_content = "\n".join([line.text for line in predictions[0].text_lines])
-        
-        # Extract exact coordinates and text data as they appear in the OCR results
-        text_lines = []
-        for line in predictions[0].text_lines:
-            # Ensure we're keeping the exact bbox format without any conversion
-            bbox = line.bbox
-            
-            line_data = {
-                'text': line.text,
-                'bbox': bbox,  # Keep the original bbox format
-                'polygon': line.polygon if hasattr(line, 'polygon') else None,
-                'confidence': float(line.confidence) if hasattr(line, 'confidence') else None,
-                'vertical': line.vertical if hasattr(line, 'vertical') else False
-            }
-            text_lines.append(line_data)
-        
-        # Generate PDF
-        pdf_filename = f"{os.path.splitext(os.path.basename(image_path))[0]}_ocr.pdf"
-        pdf_path = os.path.join(app.config['PDF_FOLDER'], pdf_filename)
-        logger.info(f"Will create PDF at: {pdf_path}")
-        
-        # Ensure PDF directory exists
-        os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+    c = canvas.Canvas(pdf_path, pagesize=A4)
+    c.showPage()
+    c.save()
+    logger.info(f"Empty PDF saved to {pdf_path}")
+
+def render_pdf(text_lines, pdf_path):
+    """Render OCR text lines onto an A4 PDF, keeping their relative positions"""
+    if not text_lines:
+        render_blank_pdf(pdf_path)
+        return
+    
+    # Save PDF using reportlab with improved Unicode support
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    
+    # List of potential Unicode fonts to try
+    font_paths = [
+        # Docker container paths
+        '/app/fonts/DejaVuSans.ttf',
+        '/app/fonts/Ubuntu-R.ttf',
+        '/app/fonts/LiberationSans-Regular.ttf',
+        '/app/fonts/FreeSans.ttf',
+        # System paths
+        '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+        '/usr/local/share/fonts/dejavu/DejaVuSans.ttf',
+        'C:\\Windows\\Fonts\\Arial.ttf',
+        'C:\\Windows\\Fonts\\DejaVuSans.ttf',
+        'C:\\Windows\\Fonts\\calibri.ttf',
+        '/System/Library/Fonts/Helvetica.ttf'
+    ]
+    
+    # Try to register the best font for Turkish
+    font_registered = False
+    registered_font_name = 'DefaultFont'
+    
+    for font_path in font_paths:
+        if os.path.exists(font_path):
+            font_name = os.path.splitext(os.path.basename(font_path))[0]
+            try:
+                logger.info(f"Registering font: {font_name} from {font_path}")
+                pdfmetrics.registerFont(TTFont(font_name, font_path))
+                font_registered = True
+                registered_font_name = font_name
+                break
+            except Exception as e:
+                logger.error(f"Error registering font {font_name}: {e}")
+    
+    if not font_registered:
+        logger.warning("Could not register any Unicode font, falling back to Helvetica")
+        registered_font_name = 'Helvetica'
         
-        # Save PDF using reportlab with improved Unicode support
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.pagesizes import A4
-        from reportlab.pdfbase import pdfmetrics
-        from reportlab.pdfbase.ttfonts import TTFont
+    logger.info(f"Using font: {registered_font_name} for PDF generation")
+    
+    # PDF dimensions and preparation
+    page_width, page_height = A4
+    c = canvas.Canvas(pdf_path, pagesize=A4)
+    
+    # Get max image dimensions for scaling; degenerate boxes must not divide by zero
+    max_y = 1
+    max_x = 1
+    for line in text_lines:
+        bbox = line['bbox']
+        max_x = max(max_x, bbox[2])
+        max_y = max(max_y, bbox[3])
+    
+    # Calculate scaling factors
+    available_width = page_width - 60  # margins
+    available_height = page_height - 60
+    scale_x = available_width / max_x
+    scale_y = available_height / max_y
+    scale_factor = min(scale_x, scale_y) * 0.95
+    
+    # Y-offset from the top
+    y_offset = page_height - 30
+    
+    # Set font size
+    avg_height = 0
+    count = 0
+    for line in text_lines:
+        text_height = line['bbox'][3] - line['bbox'][1]
+        if text_height > 0:
+            avg_height += text_height
+            count += 1
+    
+    font_size = 10  # Default
+    if count > 0:
+        avg_height = avg_height / count
+        font_size = max(8, min(12, avg_height * scale_factor * 0.7))
+    
+    # Set the font
+    c.setFont(registered_font_name, font_size)
+    
+    # Track successful text placement
+    text_success_count = 0
+    text_fallback_count = 0
+    text_failed_count = 0
+    
+    # Add each text line with fallback handling
+    for line in text_lines:
+        text = line['text']
+        bbox = line['bbox']
         
-        # List of potential Unicode fonts to try
-        font_paths = [
-            # Docker container paths
-            '/app/fonts/DejaVuSans.ttf',
-            '/app/fonts/Ubuntu-R.ttf',
-            '/app/fonts/LiberationSans-Regular.ttf',
-            '/app/fonts/FreeSans.ttf',
-            # System paths
-            '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
-            '/usr/local/share/fonts/dejavu/DejaVuSans.ttf',
-            'C:\\Windows\\Fonts\\Arial.ttf',
-            'C:\\Windows\\Fonts\\DejaVuSans.ttf',
-            'C:\\Windows\\Fonts\\calibri.ttf',
-            '/System/Library/Fonts/Helvetica.ttf'
-        ]
+        pdf_x = 30 + (bbox[0] * scale_factor)
+        pdf_y = y_offset - (bbox[1] * scale_factor)
         
-        # Try to register the best font for Turkish
-        font_registered = False
-        registered_font_name = 'DefaultFont'
+        # Try multiple approaches to render text
+        text_placed = False
         
-        for font_path in font_paths:
-            if os.path.exists(font_path):
-                font_name = os.path.splitext(os.path.basename(font_path))[0]
+        # First attempt: Try with registered Unicode font
+        try:
+            c.drawString(pdf_x, pdf_y, text)
+            text_success_count += 1
+            text_placed = True
+        except:
+            # If that failed, try with each registered font
+            if font_registered:
                 try:
-                    logger.info(f"Registering font: {font_name} from {font_path}")
-                    pdfmetrics.registerFont(TTFont(font_name, font_path))
-                    font_registered = True
-                    registered_font_name = font_name
-                    break
-                except Exception as e:
-                    logger.error(f"Error registering font {font_name}: {e}")
-        
-        if not font_registered:
-            logger.warning("Could not register any Unicode font, falling back to Helvetica")
-            registered_font_name = 'Helvetica'
-            
-        logger.info(f"Using font: {registered_font_name} for PDF generation")
-        
-        # PDF dimensions and preparation
-        page_width, page_height = A4
-        c = canvas.Canvas(pdf_path, pagesize=A4)
-        
-        # Get max image dimensions for scaling
-        max_y = 0
-        max_x = 0
-        for line in predictions[0].text_lines:
-            bbox = line.bbox
-            max_x = max(max_x, bbox[2])
-            max_y = max(max_y, bbox[3])
-        
-        # Calculate scaling factors
-        available_width = page_width - 60  # margins
-        available_height = page_height - 60
-        scale_x = available_width / max_x
-        scale_y = available_height / max_y
-        scale_factor = min(scale_x, scale_y) * 0.95
-        
-        # Y-offset from the top
-        y_offset = page_height - 30
-        
-        # Set font size
-        avg_height = 0
-        count = 0
-        for line in predictions[0].text_lines:
-            text_height = line.bbox[3] - line.bbox[1]
-            if text_height > 0:
-                avg_height += text_height
-                count += 1
-        
-        font_size = 10  # Default
-        if count > 0:
-            avg_height = avg_height / count
-            font_size = max(8, min(12, avg_height * scale_factor * 0.7))
-        
-        # Set the font
-        c.setFont(registered_font_name, font_size)
-        
-        # Track successful text placement
-        text_success_count = 0
-        text_fallback_count = 0
-        text_failed_count = 0
-        
-        # Add each text line with fallback handling
-        for line in predictions[0].text_lines:
-            text = line.text
-            bbox = line.bbox
-            
-            pdf_x = 30 + (bbox[0] * scale_factor)
-            pdf_y = y_offset - (bbox[1] * scale_factor)
-            
-            # Try multiple approaches to render text
-            text_placed = False
-            
-            # First attempt: Try with registered Unicode font
-            try:
-                c.drawString(pdf_x, pdf_y, text)
-                text_success_count += 1
-                text_placed = True
-            except:
-                # If that failed, try with each registered font
-                if font_registered:
-                    try:
-                        for font_path in font_paths:
-                            if os.path.exists(font_path):
-                                font_name = os.path.splitext(os.path.basename(font_path))[0]
-                                try:
-                                    # Try to register the font if not already registered
-                                    if font_name != registered_font_name:
-                                        pdfmetrics.registerFont(TTFont(font_name, font_path))
-                                    
-                                    # Try with this font
-                                    c.setFont(font_name, font_size)
-                                    c.drawString(pdf_x, pdf_y, text)
-                                    text_fallback_count += 1
-                                    text_placed = True
-                                    
-                                    # Reset to original font
-                                    c.setFont(registered_font_name, font_size)
-                                    break
-                                except:
-                                    # Continue to next font
-                                    continue
-                    except:
-                        # If all font attempts failed, continue to next fallback
-                        pass
-                        
-                # If still failed, try ASCII fallback
-                if not text_placed:
+                    for font_path in font_paths:
+                        if os.path.exists(font_path):
+                            font_name = os.path.splitext(os.path.basename(font_path))[0]
+                            try:
+                                # Try to register the font if not already registered
+                                if font_name != registered_font_name:
+                                    pdfmetrics.registerFont(TTFont(font_name, font_path))
+                                
+                                # Try with this font
+                                c.setFont(font_name, font_size)
+                                c.drawString(pdf_x, pdf_y, text)
+                                text_fallback_count += 1
+                                text_placed = True
+                                
+                                # Reset to original font
+                                c.setFont(registered_font_name, font_size)
+                                break
+                            except:
+                                # Continue to next font
+                                continue
+                except:
+                    # If all font attempts failed, continue to next fallback
+                    pass
+                    
+            # If still failed, try ASCII fallback
+            if not text_placed:
+                try:
+                    ascii_text = text.encode('ascii', 'replace').decode('ascii')
+                    c.setFont('Helvetica', font_size)  # Use built-in font for ASCII
+                    c.drawString(pdf_x, pdf_y, ascii_text)
+                    c.setFont(registered_font_name, font_size)  # Reset to original font
+                    logger.warning(f"Used ASCII fallback for text: {text}")
+                    text_fallback_count += 1
+                    text_placed = True
+                except:
+                    # Last resort: use a placeholder
                     try:
-                        ascii_text = text.encode('ascii', 'replace').decode('ascii')
-                        c.setFont('Helvetica', font_size)  # Use built-in font for ASCII
-                        c.drawString(pdf_x, pdf_y, ascii_text)
-                        c.setFont(registered_font_name, font_size)  # Reset to original font
-                        logger.warning(f"Used ASCII fallback for text: {text}")
-                        text_fallback_count += 1
+                        c.setFont('Helvetica', font_size)
+                        c.drawString(pdf_x, pdf_y, f"[Text at ({bbox[0]},{bbox[1]})]")
+                        c.setFont(registered_font_name, font_size)
+                        logger.error(f"Could not render text: {text}")
+                        text_failed_count += 1
                         text_placed = True
                     except:
-                        # Last resort: use a placeholder
-                        try:
-                            c.setFont('Helvetica', font_size)
-                            c.drawString(pdf_x, pdf_y, f"[Text at ({bbox[0]},{bbox[1]})]")
-                            c.setFont(registered_font_name, font_size)
-                            logger.error(f"Could not render text: {text}")
-                            text_failed_count += 1
-                            text_placed = True
-                        except:
-                            # If even this fails, just skip this text
-                            logger.error(f"Failed completely to render text at position {bbox}")
+                        # If even this fails, just skip this text
+                        logger.error(f"Failed completely to render text at position {bbox}")
+    
+    c.save()
+    logger.info(f"PDF text rendering stats: Success={text_success_count}, Fallback={text_fallback_count}, Failed={text_failed_count}")
+    logger.info(f"PDF saved to {pdf_path}")
+
+def load_image_for_ocr(source_image, scale=1.0):
+    """
+    Decode an opened image into memory, downscaling it by the given factor.
+
+    At full scale the opened image itself is returned once loaded, so there is
+    only one decoded copy; otherwise the caller still owns source_image.
+    """
+    if scale >= 1.0:
+        source_image.load()
+        return source_image
+    
+    target_size = (max(1, int(source_image.size[0] * scale)), max(1, int(source_image.size[1] * scale)))
+    # For JPEG this lets the decoder skip most of the full-resolution pixels
+    source_image.draft(source_image.mode, target_size)
+    return source_image.resize(target_size, Image.LANCZOS)
+
+def rescale_line(line_data, factor):
+    """Scale the coordinates of an extracted text line in place"""
+    line_data['bbox'] = [coord * factor for coord in line_data['bbox']]
+    if line_data.get('polygon'):
+        line_data['polygon'] = [[x * factor, y * factor] for x, y in line_data['polygon']]
+    return line_data
+
+def detect_images(images):
+    """Run text detection on a batch of images in one model call"""
+    with detection_lock:
+        return detect_text(images, det_model, det_processor)
+
+def recognize_images(images, detections, lang_lists):
+    """Recognize the detected lines of a batch of images, through the recognition buckets when enabled"""
+    with recognition_lock:
+        return recognize_detected(images, detections, lang_lists, rec_model, rec_processor, recognition_bucketer)
+
+def detect_lines(image):
+    """Run text detection on one image"""
+    return detect_images([image])[0]
+
+def recognize_lines(image, detection, lang_list):
+    """Recognize the detected lines of one image"""
+    return recognize_images([image], [detection], [lang_list])[0]
+
+def recognize_crops(crops, lang_list):
+    """Recognize line crops directly; returns (texts, confidences)"""
+    with recognition_lock:
+        if recognition_bucketer is not None:
+            return recognition_bucketer.recognize(crops, lang_list, rec_model, rec_processor)
+        from surya.recognition import batch_recognition
+        result = batch_recognition(crops, [lang_list] * len(crops), rec_model, rec_processor)
+    if isinstance(result, tuple) and len(result) == 2:
+        return result
+    return result, [None] * len(crops)
+
+def flip_detection(detection, size):
+    """Detection result of an image turned by 180 degrees, derived from the unturned one"""
+    from types import SimpleNamespace
+    
+    width, height = size
+    boxes = []
+    for box in detection.bboxes:
+        # The bottom-right corner becomes the top-left one; keep the clockwise corner order
+        polygon = [[width - x, height - y] for x, y in box.polygon]
+        polygon = polygon[2:] + polygon[:2]
+        x1, y1, x2, y2 = box.bbox
+        boxes.append(SimpleNamespace(polygon=polygon, bbox=[width - x2, height - y2, width - x1, height - y1]))
+    return SimpleNamespace(bboxes=boxes)
+
+def recognize_bboxes(image, bboxes, lang_list):
+    """Re-run recognition on given line boxes of an image; returns (texts, confidences)"""
+    # surya's run_recognition drops the confidences, so the crops go to batch_recognition directly
+    crops = [image.crop(bbox) for bbox in bboxes]
+    texts, confidences = recognize_crops(crops, lang_list)
+    return texts, [float(confidence) if confidence is not None else None for confidence in confidences]
+
+def fast_pass_image(image):
+    """
+    Downscaled copy of an image for the cheap pass of fast mode.
+    
+    Returns (image, scale); the image itself is returned when downscaling gains nothing.
+    """
+    scale = OCR_FAST_SCALE
+    if max(image.size) * scale < OCR_FAST_MIN_SIDE:
+        # Small images gain nothing from a cheap pass; keep as much detail as the floor allows
+        scale = min(1.0, OCR_FAST_MIN_SIDE / max(image.size))
+    
+    if scale >= 1.0:
+        return image, 1.0
+    small_size = (max(1, int(image.size[0] * scale)), max(1, int(image.size[1] * scale)))
+    small_image = image.resize(small_size, Image.BILINEAR)
+    return small_image, small_image.size[0] / image.size[0]
+
+def escalate_low_confidence(image, text_lines, scale, lang_list):
+    """
+    Second tier of fast mode: map the cheap-pass lines to full resolution and
+    re-run recognition there only for low-confidence lines.
+    
+    Returns the escalation stats; text_lines are updated in place.
+    """
+    if scale != 1.0:
+        for line_data in text_lines:
+            rescale_line(line_data, 1.0 / scale)
+    
+    # Lines without a confidence score are escalated as well
+    escalated = [i for i, line in enumerate(text_lines)
+                 if line['confidence'] is None or line['confidence'] < OCR_ESCALATION_CONFIDENCE]
+    improved = 0
+    if escalated and scale < 1.0:
+        bboxes = [[int(round(coord)) for coord in text_lines[i]['bbox']] for i in escalated]
+        texts, confidences = recognize_bboxes(image, bboxes, lang_list)
+        for i, text, confidence in zip(escalated, texts, confidences):
+            # A read without a confidence cannot be compared, so the cheap-pass read is kept
+            if confidence is None:
+                continue
+            previous = text_lines[i]['confidence']
+            if previous is None or confidence >= previous:
+                text_lines[i]['text'] = text
+                text_lines[i]['confidence'] = confidence
+                improved += 1
+    
+    stats = {
+        'mode': 'fast',
+        'scale': round(scale, 4),
+        'lines': len(text_lines),
+        'escalated': len(escalated) if scale < 1.0 else 0,
+        'improved': improved
+    }
+    logger.info(f"Fast OCR at scale {stats['scale']}: {stats['escalated']}/{stats['lines']} lines escalated, {improved} improved")
+    return stats
+
+class OcrJob:
+    """One image on its way through the decode, detect, recognize and render stages"""
+    def __init__(self, image_path, langs, mode=None):
+        self.image_path = image_path
+        self.langs = langs
+        self.lang_list = langs.split(',')
+        self.mode = mode or OCR_DEFAULT_MODE
+        # Pipeline threads account their work to the request that submitted the job
+        self.request_memory = memory_governor.current()
+        self.started_at = time.time()
+        self.image = None
+        self.scale = 1.0
+        self.blank = False
+        self.page_stats = None
+        self.detect_image = None
+        self.detect_scale = 1.0
+        self.detection = None
+        self.text_lines = []
+        self.ocr_stats = {}
+        # Transposes applied to the decoded image, used to map lines back onto the upload
+        self.transforms = []
+        self.orientation = {}
+    
+    def transpose(self, method):
+        """Transpose the working image, remembering how to map lines back"""
+        self.transforms.append((method, self.image.size))
+        transposed = self.image.transpose(method)
+        self.image.close()
+        self.image = transposed
+    
+    def flip(self):
+        """Turn the page and its detected lines by 180 degrees"""
+        self.detection = flip_detection(self.detection, self.detect_image.size)
+        if self.detect_image is self.image:
+            self.transpose(Image.Transpose.ROTATE_180)
+            self.detect_image = self.image
+        else:
+            flipped = self.detect_image.transpose(Image.Transpose.ROTATE_180)
+            self.detect_image.close()
+            self.detect_image = flipped
+            self.transpose(Image.Transpose.ROTATE_180)
+    
+    def turn(self, method):
+        """Turn the page by 90 or 270 degrees; its lines have to be detected again"""
+        if self.detect_image is not self.image:
+            self.detect_image.close()
+        self.detect_image = self.detection = None
+        self.transpose(method)
+
+def decode_stage(job):
+    """Decode the image within the memory budget, make it upright and check for blank pages"""
+    # Open the image lazily so its size can be checked against the memory budget before decoding
+    with memory_governor.stage('decode'):
+        # Not a with block: at full scale the opened image is kept as the working image
+        source_image = Image.open(job.image_path)
+        try:
+            logger.info(f"Image loaded: {source_image.size}")
+            original_size = source_image.size
+            exif_method = page_checks.exif_transpose_method(source_image)
+            job.image = load_image_for_ocr(source_image, memory_governor.admit_image(original_size))
+        finally:
+            if job.image is not source_image:
+                source_image.close()
+        # Factor between the processed image and the original, used to map coordinates back
+        job.scale = job.image.size[0] / original_size[0]
         
-        c.save()
-        logger.info(f"PDF text rendering stats: Success={text_success_count}, Fallback={text_fallback_count}, Failed={text_failed_count}")
-        logger.info(f"PDF saved to {pdf_path}")
+        # Phone photos carry their rotation in EXIF, which Image.open does not apply
+        if exif_method is not None:
+            job.transpose(exif_method)
+            job.orientation['exif'] = exif_method.name
+    
+    # Separator sheets and empty back sides never reach the models
+    if BLANK_PAGE_CHECK:
+        with memory_governor.stage('page_check'):
+            job.blank, job.page_stats = page_checks.check_blank(job.image, contrast=BLANK_PAGE_CONTRAST,
+                                                                max_ink_ratio=BLANK_PAGE_MAX_INK)
+        if job.blank:
+            logger.info(f"Blank page detected (ink ratio {job.page_stats['ink_ratio']}), skipping OCR")
+
+def detect_page(job):
+    """Detect the text lines of the working image; fast mode detects on a downscaled copy"""
+    if job.mode == 'fast':
+        job.detect_image, job.detect_scale = fast_pass_image(job.image)
+    else:
+        job.detect_image, job.detect_scale = job.image, 1.0
+    job.detection = detect_lines(job.detect_image)
+
+def detect_stage(job):
+    """Detect text lines"""
+    if job.blank:
+        return
+    with memory_governor.stage('detect'):
+        detect_page(job)
+
+def recognize_stage(job):
+    """Recognize the detected lines; fast mode re-recognizes low-confidence lines at full resolution"""
+    if job.blank:
+        job.text_lines = []
+        job.ocr_stats = {'mode': 'blank', 'lines': 0, 'escalated': 0, 'improved': 0}
+    else:
+        # Reads sample lines with the recognition model, which recognize_crops serializes through recognition_lock
+        # A page already turned by its EXIF tag is upright; the others are only turned when unreadable as they are
+        if ORIENTATION_CHECK and 'exif' not in job.orientation and job.detection.bboxes:
+            with memory_governor.stage('orientation'):
+                rotation, job.orientation['check'] = page_checks.check_rotation(
+                    job.detect_image, [box.bbox for box in job.detection.bboxes],
+                    lambda crops: recognize_crops(crops, job.lang_list),
+                    sample=ORIENTATION_SAMPLE_LINES, margin=ORIENTATION_FLIP_MARGIN,
+                    min_confidence=ORIENTATION_MIN_CONFIDENCE)
+                if rotation == 180:
+                    logger.info("Page is upside down, turning it by 180 degrees")
+                    job.flip()
+                elif rotation:
+                    # Lines of a sideways page were detected as columns, so detection runs again
+                    logger.info(f"Page is sideways, turning it by {rotation} degrees")
+                    job.turn(page_checks.ROTATIONS[rotation])
+                    detect_page(job)
+                if rotation:
+                    job.orientation['rotation'] = rotation
         
-        # After PDF creation
-        if os.path.exists(pdf_path):
-            logger.info(f"PDF created successfully at {pdf_path}, size: {os.path.getsize(pdf_path)} bytes")
-        else:
-            logger.error(f"Failed to create PDF at {pdf_path}")
+        # GPU kullanımı için modelleri doğru cihaza taşıyoruz, ama run_ocr'a device parametresi gönderemiyoruz
+        # O yüzden modeller zaten GPU'ya taşındıysa, GPU kullanılacaktır
+        with memory_governor.stage('recognize'):
+            job.text_lines = recognize_lines(job.detect_image, job.detection, job.lang_list)
+            if job.mode == 'fast':
+                job.ocr_stats = escalate_low_confidence(job.image, job.text_lines, job.detect_scale, job.lang_list)
+            else:
+                job.ocr_stats = {'mode': 'accurate', 'lines': len(job.text_lines), 'escalated': 0, 'improved': 0}
+        if job.detect_image is not job.image:
+            job.detect_image.close()
+        job.detect_image = job.detection = None
+    if job.page_stats is not None:
+        job.ocr_stats['page_check'] = job.page_stats
+    if job.orientation:
+        job.ocr_stats['orientation'] = job.orientation
+
+def render_stage(job):
+    """Map lines back to original coordinates, write the PDF and build the result"""
+    ocr_time = time.time() - job.started_at
+    logger.info(f"OCR processing completed in {ocr_time:.2f} seconds on {device}")
+    
+    # Get extracted text
+    text_content = "\n".join([line['text'] for line in job.text_lines])
+    
+    # The decoded image is no longer needed; release it before PDF rendering
+    job.image.close()
+    job.image = None
+    
+    # Generate PDF from the upright lines
+    pdf_filename = f"{os.path.splitext(os.path.basename(job.image_path))[0]}_ocr.pdf"
+    pdf_path = os.path.join(app.config['PDF_FOLDER'], pdf_filename)
+    logger.info(f"Will create PDF at: {pdf_path}")
+    
+    # Ensure PDF directory exists
+    os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+    
+    with memory_governor.stage('pdf'):
+        render_pdf(job.text_lines, pdf_path)
+    
+    # After PDF creation
+    if os.path.exists(pdf_path):
+        logger.info(f"PDF created successfully at {pdf_path}, size: {os.path.getsize(pdf_path)} bytes")
+    else:
+        logger.error(f"Failed to create PDF at {pdf_path}")
+    
+    # Map coordinates back onto the upload: undo the orientation fixes, then the downscaling
+    for line_data in job.text_lines:
+        page_checks.map_line_back(line_data, job.transforms)
+        if job.scale != 1.0:
+            rescale_line(line_data, 1.0 / job.scale)
+    
+    return {
+        "text": text_content,
+        "text_lines": job.text_lines,
+        "pdfUrl": f"/pdf/{pdf_filename}",
+        "ocr_stats": job.ocr_stats
+    }
+
+OCR_STAGES = (
+    ('decode', decode_stage, OCR_PIPELINE_DECODE_WORKERS),
+    ('detect', detect_stage, 1),
+    ('recognize', recognize_stage, 1),
+    ('render', render_stage, OCR_PIPELINE_RENDER_WORKERS)
+)
+
+def build_ocr_pipeline():
+    """Pipeline running the OCR stages on their own threads, connected by bounded queues"""
+    return StagePipeline(OCR_STAGES, queue_size=OCR_PIPELINE_QUEUE_SIZE,
+                         context=lambda job: memory_governor.bind(job.request_memory))
+
+def process_ocr(image_path, langs, mode=None, pipelined=True):
+    """Process image with OCR and generate PDF"""
+    logger.info(f"Processing OCR for {image_path} with languages: {langs}")
+    
+    try:
+        job = OcrJob(image_path, langs, mode)
+        if pipelined and ocr_pipeline is not None:
+            return ocr_pipeline.run(job)
         
-        return {
-            "text": text_content,
-            "text_lines": text_lines,
-            "pdfUrl": f"/pdf/{pdf_filename}"
-        }
+        for _, stage, _ in OCR_STAGES:
+            result = stage(job)
+        return result
     
     except Exception as e:
         logger.error(f"Error in OCR processing: {e}")
         raise
 
+def process_ocr_batch(image_paths, langs, mode=None):
+    """
+    OCR several images with their stages overlapped.
+    
+    Returns one entry per image: the result dict, or the exception that image failed with.
+    """
+    if ocr_pipeline is None:
+        results = []
+        for image_path in image_paths:
+            try:
+                results.append(process_ocr(image_path, langs, mode))
+            except Exception as e:
+                results.append(e)
+        return results
+    
+    futures = [ocr_pipeline.submit(OcrJob(image_path, langs, mode)) for image_path in image_paths]
+    results = []
+    for image_path, future in zip(image_paths, futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.error(f"Error in OCR processing of {image_path}: {e}")
+            results.append(e)
+    return results
+
 # Helper function to check if a file extension is allowed
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -372,6 +767,107 @@ def draw_boxes(image, text_lines, output_path):
     except Exception as e:
         logger.error(f"Error drawing bounding boxes: {e}")
 
+def index_document(ocr_result, filename, langs, owner=None):
+    """Add a processed document to the search index under its owner; failures never fail the OCR request"""
+    try:
+        pdf_url = ocr_result.get('pdfUrl', '')
+        doc_id = os.path.splitext(os.path.basename(pdf_url))[0] or uuid.uuid4().hex
+        indexed = search_index.add_document(doc_id, ocr_result.get('text_lines', []),
+                                            filename=filename, pdf_url=pdf_url, langs=langs,
+                                            tenant=owner)
+        logger.info(f"Indexed {indexed} lines of {filename} as {doc_id}")
+    except Exception as e:
+        logger.error(f"Error indexing OCR result for {filename}: {e}")
+
+class OcrRequestError(Exception):
+    """Invalid OCR request options; carries the HTTP status to answer with"""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def parse_ocr_options(form, args, headers):
+    """Validate the OCR form fields shared by the Flask and ASGI front ends"""
+    # Get languages from request
+    langs = form.get('langs', 'tr,en')
+    
+    # OCR mode: 'fast' (cheap pass + full-resolution re-recognition of low-confidence lines) or 'accurate'
+    mode = form.get('mode', OCR_DEFAULT_MODE).lower()
+    if mode not in ('fast', 'accurate'):
+        raise OcrRequestError(f"Unknown OCR mode: {mode}")
+    
+    # Optional admin-only profiling of this request: true/cprofile or torch
+    profile_mode = form.get('profile', args.get('profile', 'false')).lower()
+    if profile_mode in ('false', '0', ''):
+        profile_mode = None
+    elif not profiling.is_admin(headers.get('X-Admin-Token')):
+        raise OcrRequestError('Profiling requires a valid X-Admin-Token', 403)
+    
+    debug_mode = form.get('debug', 'false').lower() == 'true'
+    return langs, mode, profile_mode, debug_mode
+
+def run_ocr_job(file_path, filename, langs, mode, profile_mode=None, debug_mode=False, owner=None):
+    """Run OCR on a saved upload and build the /api/ocr response body; the caller holds the admission slot"""
+    with memory_governor.request(os.path.basename(file_path)):
+        # Process the image with OCR
+        if profile_mode:
+            # Profile in this thread; the pipeline would run the stages out of the profiler's sight
+            ocr_result, profile_summary = profiling.profile_call(
+                'torch' if profile_mode == 'torch' else 'cprofile', process_ocr, file_path, langs, mode=mode,
+                pipelined=False)
+        else:
+            ocr_result = process_ocr(file_path, langs, mode=mode)
+        
+        # Persist the lines so documents can be found later without re-running OCR
+        if search_index is not None:
+            with memory_governor.stage('index'):
+                index_document(ocr_result, filename, langs, owner)
+        
+        # Optional: Generate debug image with bounding boxes
+        if debug_mode and 'text_lines' in ocr_result:
+            debug_image_path = os.path.join('static', 'temp', f"debug_{os.path.basename(file_path)}")
+            with memory_governor.stage('debug_image'), Image.open(file_path) as debug_image:
+                draw_boxes(debug_image, ocr_result['text_lines'], debug_image_path)
+            ocr_result['debugImageUrl'] = f"/static/temp/{os.path.basename(debug_image_path)}"
+    
+    # Return the results with exact bbox coordinates
+    response = {
+        'success': True,
+        'text': ocr_result.get('text', ''),
+        'text_lines': ocr_result.get('text_lines', []),
+        'pdfUrl': ocr_result.get('pdfUrl', ''),
+        'debugImageUrl': ocr_result.get('debugImageUrl', '') if debug_mode else '',
+        'ocr_stats': ocr_result.get('ocr_stats', {})
+    }
+    if profile_mode:
+        response['profile'] = profile_summary
+    return response
+
+def ocr_flight_key(file_path, tenant, langs, mode, profile_mode=None, debug_mode=False):
+    """Key under which identical concurrent uploads share one OCR run, or None if this one must run on its own"""
+    # A profile measures this request's own run
+    if ocr_flights is None or profile_mode:
+        return None
+    # Sharing stays within a tenant, so one tenant's admission outcome never answers another's request
+    return content_key(file_path, tenant, langs, mode, bool(debug_mode))
+
+def ocr_error(e):
+    """Map an exception raised while handling /api/ocr to (body, status, headers)"""
+    if isinstance(e, AdmissionRejected):
+        return {'error': str(e)}, e.status, {'Retry-After': str(e.retry_after)}
+    if isinstance(e, OcrRequestError):
+        return {'error': str(e)}, e.status, {}
+    if isinstance(e, WorkerDraining):
+        return {'error': str(e)}, 503, {'Retry-After': '5'}
+    if isinstance(e, MemoryBudgetExceeded):
+        return {'error': str(e)}, 413, {}
+    return {'error': str(e)}, 500, {}
+
+@app.before_request
+def reject_while_draining():
+    """Fail readiness and new work while the worker drains before being recycled"""
+    if memory_governor.draining and request.endpoint not in ('device_info', 'serve_pdf', 'static'):
+        return jsonify({'error': f"Worker is draining ({memory_governor.drain_reason})"}), 503, {'Retry-After': '5'}
+
 @app.route('/')
 def index():
     """Render the main page"""
@@ -380,6 +876,15 @@ def index():
 @app.route('/api/ocr', methods=['POST'])
 def api_ocr():
     """API endpoint for OCR processing"""
+    # Enforce the caller's rate limit before the upload is parsed
+    tenant = AdmissionController.identify(request.headers, request.args)
+    owner = admission_controller.owner_id(request.headers)
+    try:
+        admission_controller.check_rate(tenant)
+    except AdmissionRejected as e:
+        body, status, headers = ocr_error(e)
+        return jsonify(body), status, headers
+    
     # Check if the post request has the file part
     if 'image' not in request.files:
         return jsonify({'error': 'No image part'}), 400
@@ -400,30 +905,21 @@ def api_ocr():
         file.save(file_path)
         
         try:
-            # Get languages from request
-            langs = request.form.get('langs', 'tr,en')
-            
-            # Process the image with OCR
-            ocr_result = process_ocr(file_path, langs)
+            langs, mode, profile_mode, debug_mode = parse_ocr_options(request.form, request.args, request.headers)
             
-            # Optional: Generate debug image with bounding boxes
-            debug_mode = request.form.get('debug', 'false').lower() == 'true'
-            if debug_mode and 'text_lines' in ocr_result:
-                debug_image_path = os.path.join('static', 'temp', f"debug_{os.path.basename(file_path)}")
-                draw_boxes(Image.open(file_path), ocr_result['text_lines'], debug_image_path)
-                ocr_result['debugImageUrl'] = f"/static/temp/{os.path.basename(debug_image_path)}"
+            # Wait for a fair share of the inference slots, then run OCR
+            def admitted_job():
+                with admission_controller.slot(tenant):
+                    return run_ocr_job(file_path, filename, langs, mode, profile_mode, debug_mode, owner)
             
-            # Return the results with exact bbox coordinates
-            return jsonify({
-                'success': True,
-                'text': ocr_result.get('text', ''),
-                'text_lines': ocr_result.get('text_lines', []),
-                'pdfUrl': ocr_result.get('pdfUrl', ''),
-                'debugImageUrl': ocr_result.get('debugImageUrl', '') if debug_mode else ''
-            })
+            # Retries that arrive while the same image is still being processed wait for that run instead
+            key = ocr_flight_key(file_path, tenant, langs, mode, profile_mode, debug_mode)
+            response, _ = ocr_flights.do(key, admitted_job) if key is not None else (admitted_job(), False)
+            return jsonify(response)
             
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            body, status, headers = ocr_error(e)
+            return jsonify(body), status, headers
         finally:
             # Clean up the uploaded file
             if os.path.exists(file_path):
@@ -431,11 +927,45 @@ def api_ocr():
     
     return jsonify({'error': 'Invalid file format'}), 400
 
-@app.route('/api/device-info')
-def device_info():
-    """Get device information (CPU/GPU)"""
-    gpu_info = ""
+@app.route('/api/search')
+def api_search():
+    """Search the text of previously processed documents"""
+    if search_index is None:
+        return jsonify({'error': 'Search index is disabled'}), 404
     
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query parameter q'}), 400
+    
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+        lines_per_document = max(1, min(int(request.args.get('lines', 10)), 100))
+    except ValueError:
+        return jsonify({'error': 'limit and lines must be integers'}), 400
+    
+    # Callers only see documents uploaded with their own configured API key; the admin token searches all of them
+    all_tenants = profiling.is_admin(request.headers.get('X-Admin-Token'))
+    tenant = admission_controller.owner_id(request.headers)
+    if tenant is None and not all_tenants:
+        return jsonify({'error': 'Search requires an X-API-Key configured in TENANT_LIMITS or the admin token'}), 403
+    
+    start_time = time.time()
+    try:
+        results = search_index.search(query, limit=limit, lines_per_document=lines_per_document,
+                                      tenant=tenant, all_tenants=all_tenants)
+    except Exception as e:
+        logger.error(f"Error searching for {query!r}: {e}")
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify({
+        'query': query,
+        'took_ms': round((time.time() - start_time) * 1000, 2),
+        'count': len(results),
+        'results': results
+    })
+
+def device_info_payload():
+    """Device, batch size and runtime statistics reported by /api/device-info"""
     if device == 'cuda':
         try:
             gpu_name = torch.cuda.get_device_name(0)
@@ -444,32 +974,58 @@ def device_info():
         except Exception as e:
             logger.error(f"Error getting GPU info: {e}")
             gpu_info = "CUDA (unknown model)"
-        
-        return jsonify({
-            'device': f"GPU: {gpu_info}",
-            'is_gpu': True,
-            'batch_sizes': {
-                'recognition': os.environ.get("RECOGNITION_BATCH_SIZE"),
-                'detection': os.environ.get("DETECTOR_BATCH_SIZE"),
-                'ordering': os.environ.get("ORDER_BATCH_SIZE")
-            }
-        })
+        device_name = f"GPU: {gpu_info}"
     else:
         import platform
         import multiprocessing
         
         cpu_info = platform.processor() or "Unknown CPU"
         cpu_count = multiprocessing.cpu_count()
-        
-        return jsonify({
-            'device': f"CPU: {cpu_info} ({cpu_count} cores)",
-            'is_gpu': False,
-            'batch_sizes': {
-                'recognition': os.environ.get("RECOGNITION_BATCH_SIZE"),
-                'detection': os.environ.get("DETECTOR_BATCH_SIZE"),
-                'ordering': os.environ.get("ORDER_BATCH_SIZE")
-            }
-        })
+        device_name = f"CPU: {cpu_info} ({cpu_count} cores)"
+    
+    return {
+        'device': device_name,
+        'is_gpu': device == 'cuda',
+        'batch_sizes': {
+            'recognition': os.environ.get("RECOGNITION_BATCH_SIZE"),
+            'detection': os.environ.get("DETECTOR_BATCH_SIZE"),
+            'ordering': os.environ.get("ORDER_BATCH_SIZE")
+        },
+        'memory': memory_governor.snapshot(),
+        'recognition_buckets': recognition_bucketer.stats() if recognition_bucketer is not None else None,
+        'admission': admission_controller.stats(),
+        'pipeline': ocr_pipeline.stats() if ocr_pipeline is not None else None,
+        'single_flight': ocr_flights.stats() if ocr_flights is not None else None
+    }
+
+@app.route('/api/device-info')
+def device_info():
+    """Get device information (CPU/GPU)"""
+    return jsonify(device_info_payload())
+
+@app.route('/api/admin/profile/stacks')
+def profile_stacks():
+    """Sample all worker thread stacks and return them as a folded flamegraph file"""
+    if not profiling.is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({'error': 'Profiling requires a valid X-Admin-Token'}), 403
+    
+    try:
+        seconds = min(float(request.args.get('seconds', 10)), 120)
+        interval = max(float(request.args.get('interval', 0.01)), 0.001)
+    except ValueError:
+        return jsonify({'error': 'seconds and interval must be numbers'}), 400
+    
+    try:
+        folded, samples = profiling.sample_stacks(seconds, interval)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    
+    logger.info(f"Captured {samples} stack samples over {seconds}s")
+    filename = f"stacks_{int(time.time())}.folded"
+    return Response(folded, mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'X-Sample-Count': str(samples)
+    })
 
 @app.route('/pdf/<filename>')
 def serve_pdf(filename):